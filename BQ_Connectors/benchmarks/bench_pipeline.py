@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""End-to-end pipeline benchmark
+
+Runs GetResponse, Zendesk and PushWoosh pipelines against local fake API and fake BigQuery client and
+measures pages/sec, rows/sec, peak RSS and mean latency of extraction, transformation and loading as page
+size and number of pages grow. Every case runs in a fresh process, fake API is served by the parent process.
+Results can be saved and compared with a baseline to catch regressions
+
+Run from BQ_Connectors directory:
+python -m benchmarks.bench_pipeline --sources gr zd pw --pages 10 50 --rows 1000 5000 --output bench.jsonl
+python -m benchmarks.bench_pipeline --baseline bench.jsonl --tolerance 0.2
+
+Author: Anton Popkov
+
+"""
+
+import sys
+import json
+import argparse
+import resource
+import multiprocessing
+from time import perf_counter
+from benchmarks.fakes import FakeAPIServer
+
+STAGES = {'extract': ('GeneralRequest.http_request',),
+          'transform': ('TransformationDask.run_transformation', 'TransformationArrow.run_transformation'),
+          'load': ('PaginationPipeline.flush',),
+          'wait': ('LoaderBQ.finish_loading',)}
+
+
+def make_creds(source, address, rows, engine='arrow', load_format='dataframe'):
+    """Function for building config of a pipeline pointed to fake API
+
+    Returns
+    -------
+    dict
+        config.yaml with a single pipeline section named <source>_creds
+
+    """
+    load_keys = {'date_col': 'created_at', 'primary_key': 'id', 'partition_col': 'created_on', 'sharding_date': '',
+                 'bq_region': 'EU', 'bq_writing_mode': 'WRITE_APPEND', 'by_date_del': 'N', 'in_clause_del': 'N',
+                 'load_mode': 'append', 'buffer_rows': 100000, 'buffer_bytes': 104857600, 'buffer_seconds': 300,
+                 'max_in_flight': 4, 'load_format': load_format, 'spool': 'N', 'column_types': {},
+                 'bq_table': f'bench.dataset.{source}'}
+    transform_keys = {'engine': engine, 'separator': '_', 'created_on_col': 'created_on'}
+    if source == 'gr':
+        pipeline = {'extract_keys': {'method': 'GET', 'url': f'http://{address}/gr/contacts',
+                                     'params': {'perPage': rows, 'page': 1}},
+                    'pagination_keys': {'type': 'page_number', 'concurrency': 4, 'ordered': True},
+                    'transform_keys': {**transform_keys, 'json_key': ''}}
+    elif source == 'zd':
+        pipeline = {'extract_keys': {'method': 'GET', 'url': f'http://{address}/zd/search?page=1',
+                                     'params': {'query': 'x'}},
+                    'pagination_keys': {'type': 'next_url'},
+                    'transform_keys': {**transform_keys, 'json_key': 'results'}}
+    else:
+        pipeline = {'extract_keys': {'method': 'POST', 'url': f'http://{address}/pw/logs',
+                                     'json': {'limit': rows, 'pagination_token': ''}},
+                    'pagination_keys': {'type': 'cursor', 'options': {'key': 'pagination_token', 'location': 'json'},
+                                        'stream': True, 'chunk_size': 2000},
+                    'transform_keys': {**transform_keys, 'json_key': 'rows'}}
+    pipeline['load_keys'] = load_keys
+    return {'http_session': {'pool_size': 10}, 'rate_limits': {'rate': 100000, 'capacity': 100000},
+            f'{source}_creds': pipeline}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(source, address, pages, rows, engine, load_format, job_seconds):
+    """Function for running a pipeline in a benchmark process
+
+    Returns
+    -------
+    dict
+        throughput, peak memory and stage latencies
+
+    """
+    from src.ETL import Metrics
+    from src.ETL.Loading import BQSession
+    from src.utils.request_funtions import create_pipeline
+    from benchmarks.fakes import FakeBigQueryClient
+    Metrics.configure(enabled=True)
+    creds = make_creds(source, address, rows, engine, load_format)
+    client = FakeBigQueryClient(job_seconds=job_seconds)
+    rss_start = peak_rss_mb()
+    start = perf_counter()
+    stats = create_pipeline(creds=creds, key_ind=f'{source}_creds', bq_session=BQSession(client=client)).run()
+    elapsed = perf_counter() - start
+    methods = {row['method']: row for row in Metrics.report()}
+    latency = {}
+    for stage, names in STAGES.items():
+        calls = sum(methods[name]['calls'] for name in names if name in methods)
+        seconds = sum(methods[name]['seconds'] for name in names if name in methods)
+        latency[f'{stage}_ms'] = round(seconds / calls * 1000, 2) if calls else None
+    return {'source': source, 'pages': pages, 'rows': rows, 'engine': engine, 'load_format': load_format,
+            'seconds': round(elapsed, 3), 'pages_sec': round(stats['pages'] / elapsed, 2),
+            'rows_sec': round(client.rows / elapsed), 'loaded_rows': client.rows, 'loads': stats['loads'],
+            'peak_rss_mb': round(peak_rss_mb(), 1), 'rss_growth_mb': round(peak_rss_mb() - rss_start, 1),
+            **latency}
+
+
+def compare(results, baseline_path, tolerance):
+    """Function for comparing throughput with baseline results
+
+    Returns
+    -------
+    list
+        cases slower than baseline by more than tolerance
+
+    """
+    with open(baseline_path) as file:
+        baseline = {(row['source'], row['pages'], row['rows'], row['engine'], row['load_format']): row
+                    for row in map(json.loads, file)}
+    regressions = []
+    for row in results:
+        base = baseline.get((row['source'], row['pages'], row['rows'], row['engine'], row['load_format']))
+        if base and row['pages_sec'] < base['pages_sec'] * (1 - tolerance):
+            regressions.append((row, base))
+            print(f"REGRESSION {row['source']} pages={row['pages']} rows={row['rows']}: "
+                  f"{row['pages_sec']} pages/sec, baseline {base['pages_sec']}")
+    return regressions
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmark')
+    parser.add_argument('--sources', nargs='+', default=['gr', 'zd', 'pw'], choices=['gr', 'zd', 'pw'])
+    parser.add_argument('--pages', nargs='+', type=int, default=[10, 50], help='numbers of pages')
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000, 5000], help='records per page')
+    parser.add_argument('--engine', default='arrow', choices=['arrow', 'dask'], help='transformation engine')
+    parser.add_argument('--load-format', default='dataframe', choices=['dataframe', 'parquet'])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of fake API delay per response')
+    parser.add_argument('--job-seconds', type=float, default=0.0, help='duration of fake BigQuery jobs')
+    parser.add_argument('--output', default=None, help='JSON lines file for results')
+    parser.add_argument('--baseline', default=None, help='JSON lines file with results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative drop of pages/sec')
+    args = parser.parse_args()
+    columns = ('source', 'pages', 'rows', 'pages_sec', 'rows_sec', 'peak_rss_mb', 'extract_ms', 'transform_ms',
+               'load_ms', 'wait_ms')
+    print(''.join(f'{column:>13}' for column in columns))
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for pages in args.pages:
+        for rows in args.rows:
+            with FakeAPIServer(pages=pages, rows=rows, latency=args.latency) as server:
+                for source in args.sources:
+                    with context.Pool(1) as pool:
+                        row = pool.apply(run_case, (source, server.address, pages, rows, args.engine,
+                                                    args.load_format, args.job_seconds))
+                    results.append(row)
+                    print(''.join(f'{str(row[column]):>13}' for column in columns))
+    if args.output:
+        with open(args.output, 'a') as file:
+            for row in results:
+                file.write(json.dumps(row) + '\n')
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_benchmark()
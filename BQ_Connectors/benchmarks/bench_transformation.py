@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Transformation benchmark
+
+Compares per-page time and peak memory of TransformationDask and TransformationArrow on synthetic
+API pages. Data is materialized the same way LoaderBQ does before loading. Every transformer is measured
+in a fresh process, so peaks of the Arrow memory pool are not shared between them
+
+Run from BQ_Connectors directory: python -m benchmarks.bench_transformation --rows 10000 --pages 20
+
+Author: Anton Popkov
+
+"""
+
+import gc
+import argparse
+import tracemalloc
+import multiprocessing
+import pyarrow as pa
+from time import perf_counter
+from src.ETL.Loading import to_pandas
+from src.ETL.Transformation import TransformationDask, TransformationArrow
+
+CREDS = {'json_key': 'results', 'separator': '_', 'created_on_col': 'created_on'}
+
+
+class FakeResponse:
+    """Class imitating requests response with pre-parsed json body
+
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def make_page(rows):
+    """Function for building Zendesk-like page of nested records
+
+    """
+    return {'results': [{'id': i,
+                         'status': 'open',
+                         'created_at': '2024-01-01T00:00:00Z',
+                         'via': {'channel': 'email', 'source': {'from': {'address': f'user{i}@mail.com'}}},
+                         'custom_fields': [{'id': 1, 'value': i}],
+                         'satisfaction_rating': {'score': 'good'} if i % 2 else None,
+                         'tags': ['a', 'b']} for i in range(rows)],
+            'next_page': None}
+
+
+def measure(transformer, rows, pages):
+    """Function for measuring mean time per page and peak memory of transformation and materialization.
+    Peak memory is traced on a separate page, so tracing does not slow down the timed pages
+
+    Returns
+    -------
+    tuple
+        seconds per page, peak MB allocated by python/numpy, peak MB allocated by arrow
+
+    """
+    page = make_page(rows)
+    start = perf_counter()
+    for _ in range(pages):
+        data = to_pandas(transformer(raw_data=FakeResponse(page), creds=CREDS).run_transformation())
+        del data
+    elapsed = (perf_counter() - start) / pages
+    gc.collect()
+    pool = pa.default_memory_pool()
+    arrow_start = pool.bytes_allocated()
+    tracemalloc.start()
+    data = to_pandas(transformer(raw_data=FakeResponse(page), creds=CREDS).run_transformation())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    arrow_peak = max((pool.max_memory() or 0) - arrow_start, 0)
+    return elapsed, peak / 2 ** 20, arrow_peak / 2 ** 20
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description='Transformation benchmark')
+    parser.add_argument('--rows', type=int, default=10000, help='records per page')
+    parser.add_argument('--pages', type=int, default=10, help='pages per transformer')
+    args = parser.parse_args()
+    print(f"{'transformer':<22}{'ms/page':>10}{'py peak MB':>12}{'arrow peak MB':>15}")
+    context = multiprocessing.get_context('spawn')
+    for transformer in (TransformationDask, TransformationArrow):
+        with context.Pool(1) as pool:
+            elapsed, peak, arrow_peak = pool.apply(measure, (transformer, args.rows, args.pages))
+        print(f"{transformer.__name__:<22}{elapsed * 1000:>10.1f}{peak:>12.1f}{arrow_peak:>15.1f}")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,257 @@
+"""Local stand-ins for benchmarks
+
+HTTP server emulating pagination contracts of GetResponse (totalpages header), Zendesk (next_page url)
+and PushWoosh (pagination_token), and BigQuery client implementing the calls LoaderBQ makes
+
+Author: Anton Popkov
+
+"""
+
+import io
+import json
+import gzip
+import socket
+import threading
+from time import sleep
+from datetime import datetime, timezone
+from itertools import count
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pyarrow.parquet as pq
+from google.cloud.exceptions import NotFound
+
+
+def make_records(page, rows):
+    """Function for building page of nested records similar to API responses
+
+    """
+    first = (page - 1) * rows
+    return [{'id': first + i,
+             'status': 'open',
+             'created_at': f'2024-01-{(first + i) % 28 + 1:02d}T10:00:00Z',
+             'via': {'channel': 'email', 'source': {'from': {'address': f'user{first + i}@mail.com'}}},
+             'custom_fields': [{'id': 1, 'value': i}],
+             'score': (first + i) * 0.5,
+             'tags': ['a', 'b']} for i in range(rows)]
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """Class for handling requests to fake API. Routes:
+    /gr/contacts?page=N - list of records, number of pages in totalpages header;
+    /zd/search?page=N - records under results, url of the next page in next_page;
+    /pw/logs (POST) - records under rows, token of the next page in pagination_token
+
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, route, page, build, headers=None):
+        """Method for sending page body. Encoded bodies are cached, so the server is not a bottleneck
+
+        """
+        compress = self.server.gzip and 'gzip' in self.headers.get('Accept-Encoding', '')
+        data = self.server.body((route, page, compress), lambda: self.encode(build(), compress))
+        if compress:
+            headers = {**(headers or {}), 'Content-Encoding': 'gzip'}
+        if self.server.latency:
+            sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def encode(body, compress):
+        data = json.dumps(body).encode()
+        return gzip.compress(data, compresslevel=1) if compress else data
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0])
+        if url.path == '/gr/contacts':
+            self.send_body('gr', page, lambda: self.server.page(page), {'TotalPages': str(self.server.pages)})
+        elif url.path == '/zd/search':
+            next_page = (f"http://{self.server.address}/zd/search?page={page + 1}&query=x"
+                         if page < self.server.pages else None)
+            self.send_body('zd', page, lambda: {'results': self.server.page(page), 'next_page': next_page,
+                                                'count': self.server.pages})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if urlparse(self.path).path != '/pw/logs':
+            self.send_error(404)
+            return
+        page = int(body.get('pagination_token') or 1)
+        token = str(page + 1) if page < self.server.pages else ''
+        self.send_body('pw', page, lambda: {'rows': self.server.page(page), 'pagination_token': token})
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """Class for running fake API in a background thread
+
+    Parameters
+    ----------
+
+    pages : int
+        number of pages of every source
+    rows : int
+        number of records in a page
+    latency : float
+        seconds of server-side delay of every response
+    gzip : bool
+        flag for compressing responses for clients accepting gzip
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, pages=10, rows=1000, latency=0.0, gzip=True):
+        super().__init__(('127.0.0.1', 0), FakeAPIHandler)
+        self.pages = pages
+        self.rows = rows
+        self.latency = latency
+        self.gzip = gzip
+        self.requests = 0
+        self.address = f"127.0.0.1:{self.server_address[1]}"
+        self.bodies = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def page(self, page):
+        return make_records(page, self.rows)
+
+    def body(self, key, encode):
+        with self.lock:
+            self.requests += 1
+            if key not in self.bodies:
+                self.bodies[key] = encode()
+            return self.bodies[key]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeJob:
+    """Class imitating BigQuery job. Job is done after job_seconds from submission
+
+    """
+
+    _ids = count(1)
+
+    def __init__(self, rows=0, job_seconds=0.0):
+        self.job_id = f"fake_job_{next(self._ids)}"
+        self.output_rows = rows
+        self.errors = None
+        self.started = datetime.now(timezone.utc)
+        self.ended = None
+        self.job_seconds = job_seconds
+
+    def result(self):
+        remaining = self.job_seconds - (datetime.now(timezone.utc) - self.started).total_seconds()
+        if remaining > 0:
+            sleep(remaining)
+        self.ended = datetime.now(timezone.utc)
+        return self
+
+
+class FakeTable:
+
+    def __init__(self, table_id, schema):
+        self.table_id = table_id
+        self.schema = list(schema)
+
+
+class FakeBigQueryClient:
+    """Class imitating BigQuery client with the calls made by LoaderBQ. Data frames are serialized
+    into Parquet, as the real client does before upload, so client-side cost of loading is kept
+
+    Parameters
+    ----------
+
+    job_seconds : float
+        duration of load and query jobs
+    serialize : bool
+        flag for serializing data frames into Parquet
+
+    """
+
+    def __init__(self, job_seconds=0.0, serialize=True):
+        self.job_seconds = job_seconds
+        self.serialize = serialize
+        self.datasets = set()
+        self.tables = {}
+        self.calls = {}
+        self.rows = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get_dataset(self, dataset_id):
+        self.count('get_dataset')
+        if dataset_id not in self.datasets:
+            raise NotFound(dataset_id)
+
+    def create_dataset(self, dataset, timeout=None):
+        self.count('create_dataset')
+        self.datasets.add(f"{dataset.project}.{dataset.dataset_id}")
+
+    def get_table(self, table_id):
+        self.count('get_table')
+        if table_id not in self.tables:
+            raise NotFound(table_id)
+        return self.tables[table_id]
+
+    def create_table(self, table):
+        self.count('create_table')
+        table_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+        self.tables[table_id] = FakeTable(table_id, table.schema)
+
+    def update_table(self, table, fields):
+        self.count('update_table')
+        self.tables[table.table_id] = table
+
+    def load_table_from_dataframe(self, dataframe, table_id, job_config=None):
+        self.count('load_table_from_dataframe')
+        nbytes = 0
+        if self.serialize:
+            buffer = io.BytesIO()
+            dataframe.to_parquet(buffer, index=False)
+            nbytes = buffer.getbuffer().nbytes
+        return self.loaded(len(dataframe), nbytes)
+
+    def load_table_from_file(self, file, table_id, job_config=None):
+        self.count('load_table_from_file')
+        data = file.read()
+        rows = pq.ParquetFile(io.BytesIO(data)).metadata.num_rows
+        return self.loaded(rows, len(data))
+
+    def loaded(self, rows, nbytes):
+        with self.lock:
+            self.rows += rows
+            self.bytes += nbytes
+        return FakeJob(rows, self.job_seconds)
+
+    def query(self, sql_query, job_config=None):
+        self.count('query')
+        return FakeJob(0, self.job_seconds)
@@ -7,16 +7,19 @@ Author: Anton Popkov
 """
 
 import sys
-import yaml
 import logging
+from time import perf_counter
+from src.ETL import Metrics
+from src.utils.config import get_config
 
-with open('/<path>/src/config.yaml', 'r') as file:
-    credentials = yaml.load(file, Loader=yaml.Loader)
 
-logging.basicConfig(
-    filename=credentials['logs_path'],
-    level=logging.INFO,
-    format='%(asctime)s :: %(name)s - %(levelname)s - %(message)s')
+def __getattr__(name):
+    """Function for lazy loading of config on `from src.ETL.Decorator import credentials`
+
+    """
+    if name == 'credentials':
+        return get_config()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
 
 class ErrorDecorator:
@@ -24,15 +27,22 @@ class ErrorDecorator:
     def sys_error_decorator(func):
         """Method for decorating inner class methods with try-except block.
         Tries to execute the function, raises error if fails.
+        Records wall time, rows and bytes of the call if metrics are enabled.
 
         """
 
         def wrapper(*args, **kwargs):
+            start = perf_counter() if Metrics.ENABLED else None
             try:
-                return func(*args, **kwargs)
+                result = func(*args, **kwargs)
             except Exception:
                 logging.error(f'Unexpected error in {func.__name__} {sys.exc_info()}')
+                if start is not None:
+                    Metrics.record(func.__qualname__, perf_counter() - start, error=True)
                 raise
+            if start is not None:
+                Metrics.record(func.__qualname__, perf_counter() - start, result)
+            return result
 
         return wrapper
 
@@ -7,8 +7,21 @@ Author: Anton Popkov
 """
 
 import logging
+import threading
+import requests
 from time import sleep
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from src.ETL import Metrics
+from src.ETL.Decorator import ErrorDecorator
 from src.ETL.Interfaces import ExtractorHTTP
+from src.ETL.RateLimiting import RateLimiter, retry_after_seconds
+
+RETRY_CODES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
 
 
 class GeneralRequest(ExtractorHTTP):
@@ -21,25 +34,29 @@ class GeneralRequest(ExtractorHTTP):
         method from requests module
     params : dict
         request parameters
+    rate_limiter : RateLimiter
+        rate limiter shared by requests to the same API hosts
 
     """
 
-    def __init__(self, request_func, params):
+    def __init__(self, request_func, params, rate_limiter=None):
         super().__init__()
         self.request_func = request_func
         self.params = params
+        self.rate_limiter = rate_limiter or RateLimiter()
 
     @ExtractorHTTP.sys_error_decorator
-    def http_request(self, request_params, tries_num=3):
-        """Method for http request. Take requests parameters as argument and applies it to class requests method. Tries
-        to get response several times to avoid 500 error
+    def http_request(self, request_params, tries_num=None):
+        """Method for http request. Take requests parameters as argument and applies it to class requests method.
+        Requests are throttled by the token bucket of API host. Responses 429/5xx and timeouts are retried with
+        exponential backoff respecting Retry-After header
 
         Parameters
         ----------
         request_params : dict
             parameters of request
         tries_num : int
-            number of tries to avoid 500 error
+            number of tries, taken from rate limiter if not specified
 
         Returns
         -------
@@ -47,20 +64,36 @@ class GeneralRequest(ExtractorHTTP):
             request response
 
         """
-        result = self.request_func(**request_params)
-        if result.status_code != 200:
-            if result.status_code == 500:
-                logging.error("Internal server error")
-                sleep(5)
-                tries_num -= 1
-                if not tries_num:
+        tries_num = tries_num or self.rate_limiter.max_tries
+        bucket = self.rate_limiter.bucket(request_params['url'])
+        for attempt in range(tries_num):
+            bucket.acquire()
+            try:
+                result = self.request_func(**request_params)
+            except (requests.Timeout, requests.ConnectionError):
+                if attempt == tries_num - 1:
                     logging.error("Unable to get response from server")
-                    return 0
-                return self.http_request(request_params, tries_num)
-            logging.error(f"Invalid response with code {result.status_code}")
-            return result
-        logging.info("Successful response")
-        return result
+                    raise
+                delay = self.rate_limiter.backoff(attempt)
+                logging.error(f"Connection error, retry in {delay:.1f}s")
+                sleep(delay)
+                continue
+            self.rate_limiter.update(request_params['url'], result.headers)
+            if result.status_code == 200:
+                logging.info("Successful response")
+                return result
+            if result.status_code not in RETRY_CODES:
+                logging.error(f"Invalid response with code {result.status_code}")
+                return result
+            if attempt == tries_num - 1:
+                logging.error("Unable to get response from server")
+                result.raise_for_status()
+            retry_after = retry_after_seconds(result.headers)
+            delay = self.rate_limiter.backoff(attempt, retry_after)
+            if result.status_code == 429:
+                bucket.pause(delay)
+            logging.error(f"Response with code {result.status_code}, retry in {delay:.1f}s")
+            sleep(delay)
 
     @ExtractorHTTP.sys_error_decorator
     def run_requests(self):
@@ -74,3 +107,142 @@ class GeneralRequest(ExtractorHTTP):
         """
         result = self.http_request(self.params)
         return result
+
+    def run_concurrent_requests(self, params_iter, concurrency=4, ordered=True):
+        """Method for running requests to API in a thread pool. Number of requests in flight is limited
+        to keep memory flat regardless of the number of pages
+
+        Parameters
+        ----------
+        params_iter : iterable
+            parameters of requests
+        concurrency : int
+            number of parallel requests
+        ordered : bool
+            flag for yielding responses in order of parameters, otherwise in order of completion
+
+        Yields
+        ------
+        Response object
+            request response
+
+        """
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        http_request = Metrics.bind_pipeline(self.http_request)
+        pending = deque()
+        try:
+            for params in params_iter:
+                pending.append(executor.submit(http_request, params))
+                while len(pending) >= concurrency * 2:
+                    yield from self.collect_responses(pending, ordered)
+            while pending:
+                yield from self.collect_responses(pending, ordered)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def collect_responses(pending, ordered):
+        """Method for collecting finished requests from the window of requests in flight
+
+        Parameters
+        ----------
+        pending : deque
+            futures of requests in flight
+        ordered : bool
+            flag for waiting for the oldest request instead of any finished one
+
+        Returns
+        -------
+        list
+            responses of finished requests
+
+        """
+        if ordered:
+            return [pending.popleft().result()]
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+        return [future.result() for future in done]
+
+
+class HTTPSession(ErrorDecorator):
+    """Class for persistent http session with connection pooling, keep-alive and gzip negotiation.
+    One session is shared by all pages of a run, so TCP and TLS handshakes happen once per pooled connection
+
+    Parameters
+    ----------
+
+    pool_size : int
+        max number of kept-alive connections per API host
+
+    """
+
+    def __init__(self, pool_size=10):
+        super().__init__()
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+
+    def request(self, *args, **kwargs):
+        """Method for http request through pooled connections. Has the signature of requests.request
+
+        Returns
+        -------
+        Response object
+            request response
+
+        """
+        return self.session.request(*args, **kwargs)
+
+    @ErrorDecorator.sys_error_decorator
+    def connection_stats(self):
+        """Method for counting requests and opened connections over all connection pools of the session
+
+        Returns
+        -------
+        dict
+            number of requests, opened connections and requests sent over reused connections
+
+        """
+        stats = {'requests': 0, 'connections': 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+        stats['reused'] = stats['requests'] - stats['connections']
+        return stats
+
+    def log_stats(self):
+        stats = self.connection_stats()
+        logging.info(f"HTTP session: {stats['requests']} requests over {stats['connections']} connections, "
+                     f"{stats['reused']} reused")
+
+    def close(self):
+        self.log_stats()
+        self.session.close()
+
+
+def shared_session(pool_size=10):
+    """Function for getting http session shared by all pipelines of the process
+
+    Parameters
+    ----------
+    pool_size : int
+        max number of kept-alive connections per API host
+
+    Returns
+    -------
+    HTTPSession
+        shared session
+
+    """
+    with _sessions_lock:
+        if pool_size not in _sessions:
+            _sessions[pool_size] = HTTPSession(pool_size)
+            logging.info(f"HTTP session with pool size {pool_size} created")
+        return _sessions[pool_size]
@@ -112,3 +112,49 @@ class LoaderCloud(ABC, ErrorDecorator):
 
         """
         pass
+
+
+class Paginator(ABC, ErrorDecorator):
+    """Template class for strategies that compute the next page of an API request
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.body_keys = ()
+
+    @abstractmethod
+    def next_params(self, params, response):
+        """Method for building request parameters of the next page
+
+        Returns
+        -------
+        dict or None
+            request parameters of the next page, None if the last page was reached
+
+        """
+        pass
+
+    @abstractmethod
+    def get_cursor(self, params):
+        """Method for extracting pagination cursor from request parameters, persisted in checkpoints
+
+        Returns
+        -------
+        dict
+            cursor without secrets of request
+
+        """
+        pass
+
+    @abstractmethod
+    def set_cursor(self, params, cursor):
+        """Method for applying saved pagination cursor to request parameters
+
+        Returns
+        -------
+        dict
+            request parameters of the page to resume from
+
+        """
+        pass
@@ -7,9 +7,335 @@ Author: Anton Popkov
 """
 
 import logging
-from google.cloud import bigquery
-from google.cloud.exceptions import NotFound
+import threading
+import pandas as pd
+import pyarrow as pa
+from time import monotonic
+from numbers import Number
+from concurrent.futures import ThreadPoolExecutor, wait
 from src.ETL.Interfaces import LoaderCloud
+from src.utils.bq_types import ARROW_TYPES, infer_type, to_arrow, to_parquet
+
+
+def to_pandas(data):
+    """Function for materializing transformed data as pandas DataFrame
+
+    Parameters
+    ----------
+    data : dask.DataFrame, pyarrow.Table or pandas.DataFrame
+        transformed data
+
+    Returns
+    -------
+    pandas DataFrame
+        data
+
+    """
+    if hasattr(data, 'compute'):
+        return data.compute()
+    if hasattr(data, 'to_pandas'):
+        return data.to_pandas()
+    return data
+
+
+IN_CLAUSE_BYTES = 500000
+
+
+def sql_values(values):
+    """Function for rendering values as sql literals. Numbers are kept as is, other values are quoted, nulls are skipped
+
+    """
+    rendered = []
+    for value in values:
+        if value is None or value != value:
+            continue
+        if isinstance(value, Number) and not isinstance(value, bool):
+            rendered.append(str(value))
+        else:
+            rendered.append("'{}'".format(str(value).replace('\\', '\\\\').replace("'", "\\'")))
+    return rendered
+
+
+def sql_in_list(values):
+    """Function for rendering values as list for sql IN clause. Numbers are kept as is, other values are quoted
+
+    Parameters
+    ----------
+    values : iterable
+        values of the list
+
+    Returns
+    -------
+    str
+        list in parentheses
+
+    """
+    return f"({', '.join(sql_values(values))})"
+
+
+def sql_in_lists(values, max_bytes=IN_CLAUSE_BYTES):
+    """Function for rendering values as several lists for sql IN clause, so a query with a list stays
+    below BigQuery limit of query length
+
+    Parameters
+    ----------
+    values : iterable
+        values of the lists
+    max_bytes : int
+        max length of a list in bytes
+
+    Returns
+    -------
+    list
+        lists in parentheses
+
+    """
+    lists, chunk, size = [], [], 0
+    for value in sql_values(values):
+        length = len(value.encode()) + 2
+        if chunk and size + length > max_bytes:
+            lists.append(f"({', '.join(chunk)})")
+            chunk, size = [], 0
+        chunk.append(value)
+        size += length
+    if chunk:
+        lists.append(f"({', '.join(chunk)})")
+    return lists
+
+
+class PageBuffer:
+    """Class for coalescing transformed pages into large load jobs. Buffer is full when any of configured
+    thresholds is reached, every page is a separate load if no threshold is configured
+
+    Parameters
+    ----------
+
+    buffer_rows : int
+        max number of buffered rows
+    buffer_bytes : int
+        max size of buffered data in bytes
+    buffer_seconds : float
+        max age of the oldest buffered page in seconds
+
+    """
+
+    def __init__(self, buffer_rows=0, buffer_bytes=0, buffer_seconds=0):
+        self.buffer_rows = buffer_rows
+        self.buffer_bytes = buffer_bytes
+        self.buffer_seconds = buffer_seconds
+        self.frames = []
+        self.rows = 0
+        self.bytes = 0
+        self.started = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def add(self, data):
+        """Method for adding transformed page to buffer
+
+        Parameters
+        ----------
+        data : dask.DataFrame, pyarrow.Table or pandas.DataFrame
+            transformed page
+
+        """
+        frame = to_pandas(data)
+        size = data.nbytes if isinstance(data, pa.Table) else int(frame.memory_usage(deep=True).sum())
+        if not self.frames:
+            self.started = monotonic()
+        self.frames.append(frame)
+        self.rows += len(frame)
+        self.bytes += size
+
+    def is_full(self):
+        """Method for checking whether buffered pages should be loaded
+
+        Returns
+        -------
+        bool
+            flag indicating whether any threshold is reached
+
+        """
+        if not self.frames:
+            return False
+        if not (self.buffer_rows or self.buffer_bytes or self.buffer_seconds):
+            return True
+        return bool((self.buffer_rows and self.rows >= self.buffer_rows)
+                    or (self.buffer_bytes and self.bytes >= self.buffer_bytes)
+                    or (self.buffer_seconds and monotonic() - self.started >= self.buffer_seconds))
+
+    def drain(self):
+        """Method for concatenating buffered pages and emptying buffer. Columns missing in some pages
+        are filled with nulls
+
+        Returns
+        -------
+        pandas DataFrame
+            buffered data
+
+        """
+        frame = self.frames[0] if len(self.frames) == 1 else pd.concat(self.frames, ignore_index=True)
+        logging.info(f"{len(self.frames)} pages with {self.rows} rows drained from buffer")
+        self.frames, self.rows, self.bytes, self.started = [], 0, 0, None
+        return frame
+
+
+class LoadJobTracker:
+    """Class for tracking BigQuery load jobs without blocking the loader. Number of jobs in flight is bounded,
+    jobs are polled concurrently and summarized in a completion report
+
+    Parameters
+    ----------
+
+    max_in_flight : int
+        max number of unfinished load jobs, submitting one more blocks until a job finishes
+
+    """
+
+    def __init__(self, max_in_flight=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='bq-load')
+        self.window = threading.BoundedSemaphore(max_in_flight)
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def submit(self, job, table_id, rows, nbytes):
+        """Method for adding load job to the window of jobs in flight
+
+        Parameters
+        ----------
+        job : LoadJob
+            submitted load job
+        table_id : str
+            destination table
+        rows : int
+            number of rows sent
+        nbytes : int
+            size of data sent
+
+        """
+        self.window.acquire()
+        future = self.executor.submit(self.poll_job, job, table_id, rows, nbytes, monotonic())
+        future.add_done_callback(lambda _: self.window.release())
+        with self.lock:
+            self.futures.append((table_id, future))
+
+    @staticmethod
+    def poll_job(job, table_id, rows, nbytes, submitted):
+        """Method for waiting for load job and collecting its statistics
+
+        Returns
+        -------
+        dict
+            job report
+
+        """
+        error = None
+        try:
+            job.result()
+        except Exception as exc:
+            error = str(exc)
+        started, ended = getattr(job, 'started', None), getattr(job, 'ended', None)
+        duration = (ended - started).total_seconds() if started and ended else monotonic() - submitted
+        report = {'job_id': getattr(job, 'job_id', None), 'table': table_id,
+                  'rows': getattr(job, 'output_rows', None) or rows, 'bytes': nbytes,
+                  'duration': round(duration, 3), 'errors': error or getattr(job, 'errors', None)}
+        if report['errors']:
+            logging.error(f"Load job {report['job_id']} into {table_id} failed: {report['errors']}")
+        return report
+
+    def wait_all(self, tables=None):
+        """Method for waiting for jobs in flight
+
+        Parameters
+        ----------
+        tables : set
+            destination tables to wait for, all jobs if not specified
+
+        Returns
+        -------
+        list
+            reports of finished jobs
+
+        """
+        with self.lock:
+            selected = [(t, f) for t, f in self.futures if tables is None or t in tables]
+            self.futures = [(t, f) for t, f in self.futures if not (tables is None or t in tables)]
+        wait([future for _, future in selected])
+        return [future.result() for _, future in selected]
+
+
+class BQSession:
+    """Class for run-level BigQuery session. Keeps a single client and caches existence of datasets
+    and column names of tables, so metadata is requested only for the first page and when new columns appear
+
+    Parameters
+    ----------
+
+    client : BigQuery client
+        authorized client, created on first use if not specified
+    max_in_flight : int
+        max number of unfinished load jobs
+
+    """
+
+    def __init__(self, client=None, max_in_flight=4):
+        self._client = client
+        self.datasets = set()
+        self.tables = {}
+        self.column_types = {}
+        self.lock = threading.RLock()
+        self.tracker = LoadJobTracker(max_in_flight)
+
+    @property
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                from google.cloud import bigquery
+                self._client = bigquery.Client()
+                logging.info("BQ Client created")
+            return self._client
+
+    def is_known(self, table_id, schema):
+        """Method for checking that table exists and has all columns of schema
+
+        Parameters
+        ----------
+        table_id : str
+            full table name
+        schema : list
+            schema of loaded data
+
+        Returns
+        -------
+        bool
+            flag indicating whether metadata requests can be skipped
+
+        """
+        columns = self.tables.get(table_id)
+        return columns is not None and {field.name for field in schema} <= columns
+
+    def finish(self, tables=None):
+        """Method for waiting for load jobs in flight and building completion report
+
+        Parameters
+        ----------
+        tables : set
+            destination tables to wait for, all jobs if not specified
+
+        Returns
+        -------
+        list
+            reports of finished jobs
+
+        """
+        reports = self.tracker.wait_all(tables)
+        failed = [report for report in reports if report['errors']]
+        rows = sum(report['rows'] or 0 for report in reports)
+        logging.info(f"{len(reports)} load jobs finished, {rows} rows loaded, {len(failed)} failed")
+        if failed:
+            raise RuntimeError(f"{len(failed)} load jobs failed: {[report['job_id'] for report in failed]}")
+        return reports
 
 
 class LoaderBQ(LoaderCloud):
@@ -20,19 +346,23 @@ class LoaderBQ(LoaderCloud):
 
     creds : dict
         creds for authorization in BigQuery
-    data : dask.DataFrame
-        data to load into BigQuery
+    data : dask.DataFrame, pyarrow.Table or pandas.DataFrame
+        data to load into BigQuery, materialized once as pandas DataFrame
+    session : BQSession
+        run-level session shared by pages of a run, new session is created if not specified
 
     """
 
-    def __init__(self, data, creds):
+    def __init__(self, data, creds, session=None):
         super().__init__()
         self.creds = creds
-        self.data = data
+        self.data = to_pandas(data)
+        self.owns_session = session is None
+        self.session = session or BQSession()
 
     @LoaderCloud.sys_error_decorator
     def create_client(self):
-        """Method for creating BigQuery client
+        """Method for getting BigQuery client of the session
 
         Returns
         -------
@@ -40,13 +370,78 @@ class LoaderBQ(LoaderCloud):
             client object
 
         """
-        client = bigquery.Client()
-        logging.info("BQ Client created")
-        return client
+        return self.session.client
+
+    def get_table_id(self, staging=False):
+        """Method for getting full name of destination table with sharding date suffix
+
+        Parameters
+        ----------
+        staging : bool
+            flag for getting name of staging table of merge load mode
+
+        Returns
+        -------
+        str
+            table name
+
+        """
+        table_id = self.creds['bq_table']
+        if staging:
+            table_id = self.creds.get('staging_table') or f"{table_id}_staging"
+        if self.creds['sharding_date']:
+            table_id = f"{table_id}_{self.creds['sharding_date']}"
+        return table_id
+
+    def is_typed(self):
+        return self.creds.get('load_format') == 'parquet'
+
+    @LoaderCloud.sys_error_decorator
+    def get_table_types(self, table_id):
+        """Method for getting BigQuery types of columns of an existing table
+
+        Returns
+        -------
+        dict
+            column name and BigQuery type, empty if table does not exist
+
+        """
+        from google.cloud.exceptions import NotFound
+        try:
+            schema = self.create_client().get_table(table_id).schema
+        except NotFound:
+            return {}
+        return {field.name: field.field_type for field in schema if field.field_type in ARROW_TYPES}
+
+    @LoaderCloud.sys_error_decorator
+    def get_column_types(self):
+        """Method for getting BigQuery types of columns in typed load mode. Types are taken from column_types
+        of load_keys, then from schema of the existing destination table, other columns are inferred once
+        per run and cached in session
+
+        Returns
+        -------
+        dict
+            column name and BigQuery type
+
+        """
+        table_id = self.get_table_id()
+        with self.session.lock:
+            known = self.session.column_types.get(table_id)
+            if known is None:
+                known = self.session.column_types[table_id] = self.get_table_types(table_id)
+            known.update({col: bq_type.upper() for col, bq_type in (self.creds.get('column_types') or {}).items()})
+            new_columns = [col for col in self.data.columns if col not in known]
+            for col in new_columns:
+                known[col] = 'DATETIME' if col == self.creds['partition_col'] else infer_type(self.data[col])
+            if new_columns:
+                logging.info(f"Types inferred for {new_columns}")
+            return {col: known[col] for col in self.data.columns}
 
     @LoaderCloud.sys_error_decorator
     def create_schema(self):
-        """Method for creating schema of a BigQuery table
+        """Method for creating schema of a BigQuery table. In typed load mode declared or inferred types are used,
+        otherwise every column except partitioning one is STRING
 
         Returns
         -------
@@ -54,6 +449,9 @@ class LoaderBQ(LoaderCloud):
             list of BigQuery types
 
         """
+        from google.cloud import bigquery
+        if self.is_typed():
+            return [bigquery.SchemaField(col, bq_type) for col, bq_type in self.get_column_types().items()]
         columns = list(self.data.columns)
         schema = [bigquery.SchemaField(col, "STRING") if col != self.creds['partition_col']
                   else bigquery.SchemaField(col, "DATETIME") for col in columns]
@@ -75,6 +473,7 @@ class LoaderBQ(LoaderCloud):
             flag indicating whether object exists
 
         """
+        from google.cloud.exceptions import NotFound
         try:
             func(obj_name)
             logging.info(f"{obj_name} already exists")
@@ -100,14 +499,18 @@ class LoaderBQ(LoaderCloud):
         project_id = self.creds['bq_table'].split('.')[0]
         dataset_id = self.creds['bq_table'].split('.')[1]
         dataset_name = f"{project_id}.{dataset_id}"
+        if dataset_name in self.session.datasets:
+            return
         if not self.check_if_exists(client.get_dataset, dataset_name):
+            from google.cloud import bigquery
             dataset = bigquery.Dataset(dataset_name)
             dataset.location = self.creds['bq_region']
             client.create_dataset(dataset, timeout=60)
             logging.info(f"{dataset_name} successfully created")
+        self.session.datasets.add(dataset_name)
 
     @LoaderCloud.sys_error_decorator
-    def create_table_if_not_exists(self, client, schema):
+    def create_table_if_not_exists(self, client, schema, table_id=None):
         """Method for creating BigQuery table if not exists
 
         Parameters
@@ -116,16 +519,17 @@ class LoaderBQ(LoaderCloud):
             authorized BigQuery client
         schema : list
             schema for BigQuery table
+        table_id : str
+            full table name, destination table if not specified
 
         Returns
         -------
         None
 
         """
-        table_id = self.creds['bq_table']
-        if self.creds['sharding_date']:
-            table_id = f"{self.creds['bq_table']}_{self.creds['sharding_date']}"
+        table_id = table_id or self.get_table_id()
         if not self.check_if_exists(client.get_table, table_id):
+            from google.cloud import bigquery
             table = bigquery.Table(table_id, schema=schema)
             table.time_partitioning = bigquery.TimePartitioning(
                                           type_=bigquery.TimePartitioningType.DAY,
@@ -135,30 +539,98 @@ class LoaderBQ(LoaderCloud):
             logging.info(f"{table_id} successfully created")
 
     @LoaderCloud.sys_error_decorator
-    def load_data(self, client):
-        """Method for loading data into BigQuery table
+    def update_schema(self, client, schema, table_id):
+        """Method for adding new columns of loaded data to BigQuery table
 
         Parameters
         ----------
         client : BigQuery client
             authorized BigQuery client
+        schema : list
+            schema of loaded data
+        table_id : str
+            full table name
+
+        Returns
+        -------
+        set
+            column names of the table
+
+        """
+        table = client.get_table(table_id)
+        current_schema = table.schema
+        current_columns = {field.name for field in current_schema}
+        new_columns = [field for field in schema if field.name not in current_columns]
+        if new_columns:
+            current_schema.extend(new_columns)
+            table.schema = current_schema
+            client.update_table(table, ["schema"])
+            logging.info(f"{len(new_columns)} columns added to {table_id}")
+        return current_columns | {field.name for field in new_columns}
+
+    @LoaderCloud.sys_error_decorator
+    def prepare_table(self, client, schema, table_id):
+        """Method for creating dataset and table and evolving table schema. Skipped if session already knows
+        the table with all columns of loaded data
+
+        Parameters
+        ----------
+        client : BigQuery client
+            authorized BigQuery client
+        schema : list
+            schema of loaded data
+        table_id : str
+            full table name
 
         Returns
         -------
         None
 
         """
-        dataset_id = self.creds['bq_table'].split('.')[1]
-        table_id = self.creds['bq_table'].split('.')[2]
-        if self.creds['sharding_date']:
-            table_id = f"{table_id}_{self.creds['sharding_date']}"
-        table_ref = client.dataset(dataset_id).table(table_id)
-        data = self.data.compute()
+        if self.session.is_known(table_id, schema):
+            return
+        with self.session.lock:
+            self.create_dataset_if_not_exists(client)
+            self.create_table_if_not_exists(client, schema, table_id)
+            self.session.tables[table_id] = self.update_schema(client, schema, table_id)
+
+    @LoaderCloud.sys_error_decorator
+    def load_data(self, client, table_id=None):
+        """Method for loading data into BigQuery table. In typed load mode data is uploaded as compressed
+        Parquet with explicit schema instead of autodetect
+
+        Parameters
+        ----------
+        client : BigQuery client
+            authorized BigQuery client
+        table_id : str
+            full table name, destination table if not specified
+
+        Returns
+        -------
+        LoadJob
+            load job, tracked by the session without blocking
+
+        """
+        from google.cloud import bigquery
+        table_id = table_id or self.get_table_id()
         job_config = bigquery.LoadJobConfig()
-        job_config.autodetect = True
         job_config.write_disposition = self.creds['bq_writing_mode']
-        load_job = client.load_table_from_dataframe(data, table_ref, job_config=job_config)
+        if self.is_typed():
+            job_config.source_format = bigquery.SourceFormat.PARQUET
+            job_config.schema = self.create_schema()
+            job_config.autodetect = False
+            parquet = to_parquet(to_arrow(self.data, self.get_column_types()),
+                                 self.creds.get('parquet_compression', 'zstd'))
+            nbytes = parquet.getbuffer().nbytes
+            load_job = client.load_table_from_file(parquet, table_id, job_config=job_config)
+        else:
+            job_config.autodetect = True
+            nbytes = int(self.data.memory_usage(deep=True).sum())
+            load_job = client.load_table_from_dataframe(self.data, table_id, job_config=job_config)
+        self.session.tracker.submit(load_job, table_id, len(self.data), nbytes)
         logging.info(f'Data loaded at {load_job}')
+        return load_job
 
     @LoaderCloud.sys_error_decorator
     def bq_query(self, sql_query, client):
@@ -180,9 +652,66 @@ class LoaderBQ(LoaderCloud):
         logging.info(f"{sql_query.split(' ')[0]} executed")
         return result
 
+    @LoaderCloud.sys_error_decorator
+    def merge_query(self, client):
+        """Method for building MERGE of staging table into destination table on primary key.
+        Only the latest row of every key in staging table is merged
+
+        Parameters
+        ----------
+        client : BigQuery client
+            authorized BigQuery client
+
+        Returns
+        -------
+        str
+            MERGE statement
+
+        """
+        keys = self.creds['primary_key']
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        columns = [field.name for field in client.get_table(self.get_table_id(staging=True)).schema]
+        order_col = self.creds.get('merge_order_col') or self.creds['date_col']
+        on_clause = ' and '.join(f"T.`{key}` = S.`{key}`" for key in keys)
+        partition_by = ', '.join(f"`{key}`" for key in keys)
+        update_set = ', '.join(f"`{col}` = S.`{col}`" for col in columns if col not in keys)
+        insert_cols = ', '.join(f"`{col}`" for col in columns)
+        insert_values = ', '.join(f"S.`{col}`" for col in columns)
+        query = (f"merge `{self.get_table_id()}` T "
+                 f"using (select * except(_row_num) from ("
+                 f"select *, row_number() over (partition by {partition_by} order by `{order_col}` desc) as _row_num "
+                 f"from `{self.get_table_id(staging=True)}`) where _row_num = 1) S "
+                 f"on {on_clause} "
+                 f"when matched then update set {update_set} "
+                 f"when not matched then insert ({insert_cols}) values ({insert_values})")
+        return query
+
+    @LoaderCloud.sys_error_decorator
+    def execute_merge(self):
+        """Method for merging staging table into destination table and truncating staging table.
+        Used in merge load mode at the end of a run or every merge_every pages
+
+        Returns
+        -------
+        None
+
+        """
+        client = self.create_client()
+        staging_id = self.get_table_id(staging=True)
+        self.session.finish({staging_id})
+        if not self.check_if_exists(client.get_table, staging_id):
+            return
+        self.bq_query(self.merge_query(client), client).result()
+        self.bq_query(f"truncate table `{staging_id}`", client).result()
+        logging.info(f"{staging_id} merged into {self.get_table_id()}")
+
     @LoaderCloud.sys_error_decorator
     def execute_loading(self):
-        """Method for running loading pipeline. Sequentially executes Loader class methods
+        """Method for running loading pipeline. Sequentially executes Loader class methods.
+        In merge load mode data is appended to staging table instead of deleting and appending.
+        Load job is not awaited, deletes wait for unfinished loads into the same table. Delete templates get
+        name of destination table as {table}, deletes by date of a backfill window are limited by window_end.
+        Delete by primary keys is split into queries with lists of in_clause_bytes at most
 
         Returns
         -------
@@ -190,25 +719,40 @@ class LoaderBQ(LoaderCloud):
 
         """
         client = self.create_client()
-        self.create_dataset_if_not_exists(client)
         schema = self.create_schema()
-        self.create_table_if_not_exists(client, schema)
-        table_id = self.creds['bq_table']
-        if self.creds['sharding_date']:
-            table_id = f"{table_id}_{self.creds['sharding_date']}"
-        table = client.get_table(table_id)
-        current_schema = table.schema
-        new_columns = list(set(schema).difference(set(current_schema)))
-        if new_columns:
-            current_schema.extend(new_columns)
-            table.schema = current_schema
-            client.update_table(table, ["schema"])
-        if self.creds['by_date_del'] == 'Y':
-            date = self.data[self.creds['date_col']].min().compute()
-            del_query = self.creds['delete_by_date'].format(start_date=date)
-            self.bq_query(del_query, client)
-        if self.creds['in_clause_del'] == 'Y':
-            arr = tuple(self.data[self.creds['primary_key']].unique().compute())
-            del_query = self.creds['delete_by_condition'].format(arr=arr)
-            self.bq_query(del_query, client)
-        self.load_data(client)
+        self.prepare_table(client, schema, self.get_table_id())
+        if self.creds.get('load_mode') == 'merge':
+            staging_id = self.get_table_id(staging=True)
+            self.prepare_table(client, schema, staging_id)
+            self.load_data(client, staging_id)
+        else:
+            if self.creds['by_date_del'] == 'Y' or self.creds['in_clause_del'] == 'Y':
+                self.session.finish({self.get_table_id()})
+            if self.creds['by_date_del'] == 'Y':
+                date = self.data[self.creds['date_col']].min()
+                if self.creds.get('window_end'):
+                    del_query = self.creds['delete_by_window'].format(table=self.get_table_id(), start_date=date,
+                                                                      end_date=self.creds['window_end'])
+                else:
+                    del_query = self.creds['delete_by_date'].format(table=self.get_table_id(), start_date=date)
+                self.bq_query(del_query, client).result()
+            if self.creds['in_clause_del'] == 'Y':
+                for arr in sql_in_lists(self.data[self.creds['primary_key']].unique(),
+                                        self.creds.get('in_clause_bytes') or IN_CLAUSE_BYTES):
+                    del_query = self.creds['delete_by_condition'].format(table=self.get_table_id(), arr=arr)
+                    self.bq_query(del_query, client).result()
+            self.load_data(client)
+        if self.owns_session:
+            self.session.finish()
+
+    @LoaderCloud.sys_error_decorator
+    def finish_loading(self):
+        """Method for waiting for load jobs of the destination and staging tables at the end of a run
+
+        Returns
+        -------
+        list
+            reports of finished load jobs
+
+        """
+        return self.session.finish({self.get_table_id(), self.get_table_id(staging=True)})
@@ -0,0 +1,313 @@
+"""Classes for API pagination
+
+Strategies for computing request parameters of the next page from API response
+
+Author: Anton Popkov
+
+"""
+
+import logging
+from copy import deepcopy
+from src.ETL.Interfaces import Paginator
+
+
+class PageNumberPaginator(Paginator):
+    """Class for page-number pagination (GetResponse). Total number of pages is taken from response header
+
+    Parameters
+    ----------
+
+    page_param : str
+        name of the page number request parameter
+    total_header : str
+        name of the response header with total number of pages
+
+    """
+
+    def __init__(self, page_param='page', total_header='totalpages'):
+        super().__init__()
+        self.page_param = page_param
+        self.total_header = total_header
+
+    @Paginator.sys_error_decorator
+    def total_pages(self, response):
+        """Method for getting total number of pages from response header
+
+        Parameters
+        ----------
+        response : Response object
+            API response
+
+        Returns
+        -------
+        int
+            total number of pages
+
+        """
+        return int(response.headers[self.total_header])
+
+    @Paginator.sys_error_decorator
+    def next_params(self, params, response):
+        """Method for incrementing page number of request
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the current page
+        response : Response object
+            API response of the current page
+
+        Returns
+        -------
+        dict or None
+            request parameters of the next page
+
+        """
+        page = params['params'][self.page_param]
+        if page >= self.total_pages(response):
+            return None
+        next_params = deepcopy(params)
+        next_params['params'][self.page_param] = page + 1
+        return next_params
+
+    def get_cursor(self, params):
+        """Method for extracting page number from request parameters, saved in checkpoints
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the page
+
+        Returns
+        -------
+        dict
+            cursor with page number
+
+        """
+        return {'page': params['params'][self.page_param]}
+
+    def set_cursor(self, params, cursor):
+        """Method for replacing page number of request with the one of saved cursor
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the first page
+        cursor : dict
+            cursor saved in checkpoint
+
+        Returns
+        -------
+        dict
+            request parameters of the page to resume from
+
+        """
+        next_params = deepcopy(params)
+        next_params['params'][self.page_param] = cursor['page']
+        return next_params
+
+    def remaining_params(self, params, response):
+        """Method for building request parameters of all pages after the current one. Used for concurrent
+        fetching once total number of pages is known from the first response
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the current page
+        response : Response object
+            API response of the current page
+
+        Yields
+        ------
+        dict
+            request parameters of the next pages
+
+        """
+        for page in range(params['params'][self.page_param] + 1, self.total_pages(response) + 1):
+            next_params = deepcopy(params)
+            next_params['params'][self.page_param] = page
+            yield next_params
+
+
+class NextUrlPaginator(Paginator):
+    """Class for next-url pagination (Zendesk). Url of the next page is taken from response body
+
+    Parameters
+    ----------
+
+    key : str
+        response key with url of the next page
+
+    """
+
+    def __init__(self, key='next_page'):
+        super().__init__()
+        self.key = key
+        self.body_keys = (key,)
+
+    @Paginator.sys_error_decorator
+    def next_params(self, params, response):
+        """Method for replacing request url with url of the next page
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the current page
+        response : Response object
+            API response of the current page
+
+        Returns
+        -------
+        dict or None
+            request parameters of the next page
+
+        """
+        next_page = response.json()[self.key]
+        if not next_page:
+            return None
+        next_params = deepcopy(params)
+        next_params['url'] = next_page.split('&')[0]
+        return next_params
+
+    def get_cursor(self, params):
+        """Method for extracting url of the page from request parameters, saved in checkpoints
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the page
+
+        Returns
+        -------
+        dict
+            cursor with url of the page
+
+        """
+        return {'url': params['url']}
+
+    def set_cursor(self, params, cursor):
+        """Method for replacing url of request with the one of saved cursor
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the first page
+        cursor : dict
+            cursor saved in checkpoint
+
+        Returns
+        -------
+        dict
+            request parameters of the page to resume from
+
+        """
+        next_params = deepcopy(params)
+        next_params['url'] = cursor['url']
+        return next_params
+
+
+class CursorTokenPaginator(Paginator):
+    """Class for cursor-token pagination (PushWoosh). Token of the next page is taken from response body
+
+    Parameters
+    ----------
+
+    key : str
+        response key with token of the next page
+    location : str
+        section of request parameters where token is sent ('json' or 'params')
+
+    """
+
+    def __init__(self, key='pagination_token', location='json'):
+        super().__init__()
+        self.key = key
+        self.location = location
+        self.body_keys = (key,)
+
+    @Paginator.sys_error_decorator
+    def next_params(self, params, response):
+        """Method for replacing cursor token of request with token of the next page
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the current page
+        response : Response object
+            API response of the current page
+
+        Returns
+        -------
+        dict or None
+            request parameters of the next page
+
+        """
+        token = response.json()[self.key]
+        if not token:
+            return None
+        next_params = deepcopy(params)
+        next_params[self.location][self.key] = token
+        return next_params
+
+    def get_cursor(self, params):
+        """Method for extracting cursor token from request parameters, saved in checkpoints
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the page
+
+        Returns
+        -------
+        dict
+            cursor with cursor token
+
+        """
+        return {'token': params[self.location][self.key]}
+
+    def set_cursor(self, params, cursor):
+        """Method for replacing cursor token of request with the one of saved cursor
+
+        Parameters
+        ----------
+        params : dict
+            request parameters of the first page
+        cursor : dict
+            cursor saved in checkpoint
+
+        Returns
+        -------
+        dict
+            request parameters of the page to resume from
+
+        """
+        next_params = deepcopy(params)
+        next_params[self.location][self.key] = cursor['token']
+        return next_params
+
+
+PAGINATORS = {
+    'page_number': PageNumberPaginator,
+    'next_url': NextUrlPaginator,
+    'cursor': CursorTokenPaginator,
+}
+
+
+def create_paginator(pagination_keys):
+    """Function for creating pagination strategy from pagination_keys section of config.yaml
+
+    Parameters
+    ----------
+    pagination_keys : dict
+        pagination type and optional parameters of the strategy
+
+    Returns
+    -------
+    Paginator
+        pagination strategy
+
+    """
+    paginator_type = pagination_keys['type']
+    options = pagination_keys.get('options') or {}
+    logging.info(f"{paginator_type} pagination selected")
+    return PAGINATORS[paginator_type](**options)
@@ -0,0 +1,416 @@
+"""Classes for running ETL pipelines
+
+Pipelined pagination driver running extraction, transformation and loading as overlapping stages
+
+Author: Anton Popkov
+
+"""
+
+import sys
+import logging
+import threading
+import pandas as pd
+from copy import deepcopy
+from itertools import tee
+from queue import Queue, Empty, Full
+from src.ETL import Metrics
+from src.ETL.Decorator import ErrorDecorator
+from src.ETL.Loading import PageBuffer
+from src.ETL.Streaming import JSONStream
+
+_DONE = object()
+_MID_PAGE = object()
+
+
+def request_window(params):
+    """Function for getting request window of a run - request parameters without headers, which carry secrets
+
+    """
+    return {key: value for key, value in params.items() if key != 'headers'}
+
+
+class PaginationPipeline(ErrorDecorator):
+    """Class for running paginated ETL job. Extraction, transformation and loading run in separate threads
+    joined by bounded queues, so the next page is fetched while the current page is transformed and the
+    previous one is loaded. Memory is limited by the size of the queues regardless of the number of pages
+
+    Parameters
+    ----------
+
+    creds : dict
+        pipeline section of config.yaml (extract_keys, transform_keys, load_keys)
+    paginator : Paginator
+        strategy for computing request parameters of the next page
+    request_func : func
+        method from requests module
+    extractor : ExtractorHTTP class
+        class for http requests to API
+    transformer : Transformation class
+        class for transformation of API responses
+    loader : LoaderCloud class
+        class for loading transformed data
+    queue_size : int
+        max number of pages waiting between two stages
+    concurrency : int
+        number of parallel requests for paginators which know the total number of pages
+    ordered : bool
+        flag for passing concurrently fetched pages to transformation in page order
+    rate_limiter : RateLimiter
+        rate limiter shared by requests of the pipeline
+    stream : bool
+        flag for parsing responses incrementally and passing them to transformation in chunks of records
+    chunk_size : int
+        number of records in a chunk of streamed response
+    loader_session : object
+        run-level session of the loader (e.g. BQSession) shared by all pages
+    spool : PageSpool
+        on-disk spool of transformed pages, loading consumes spooled pages at its own speed if specified
+    checkpoints : CheckpointStore
+        store of pagination cursors, cursor of the next page is saved after every durable load if specified
+    name : str
+        pipeline name from config.yaml, key of checkpoints
+    resume : bool
+        flag for starting from the saved checkpoint instead of the first page
+    watermarks : WatermarkStore
+        store of max loaded values of date column, moved forward after a successful run if specified
+
+    """
+
+    def __init__(self, creds, paginator, request_func, extractor, transformer, loader, queue_size=2,
+                 concurrency=1, ordered=True, rate_limiter=None, stream=False, chunk_size=5000,
+                 loader_session=None, spool=None, checkpoints=None, name=None, resume=False,
+                 watermarks=None):
+        super().__init__()
+        self.creds = creds
+        self.paginator = paginator
+        self.request_func = request_func
+        self.extractor = extractor
+        self.transformer = transformer
+        self.loader = loader
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.rate_limiter = rate_limiter
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.loader_session = loader_session
+        self.spool = spool
+        self.spooled = []
+        self.checkpoints = checkpoints
+        self.name = name
+        self.resume = resume
+        self.cursor = _MID_PAGE
+        self.window = None
+        self.watermarks = watermarks
+        self.watermark = None
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.pages = 0
+        self.loads = 0
+        self.rows = 0
+        self.load_jobs = []
+
+    def put(self, queue, item):
+        """Method for putting item into bounded queue. Gives up if another stage has failed
+
+        Returns
+        -------
+        bool
+            flag indicating whether item was put
+
+        """
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue):
+        """Method for getting item from queue. Returns end marker if another stage has failed
+
+        """
+        while not self.stop_event.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                continue
+        return _DONE
+
+    def emit_page(self, response, params=None):
+        """Method for passing response to transformation. In streaming mode the body is parsed incrementally
+        and passed in chunks of records. The last item of a page carries pagination cursor of the next page,
+        so the last chunk is held back until the whole body is parsed
+
+        Parameters
+        ----------
+        response : Response object
+            API response
+        params : dict
+            request parameters of the page, cursor of the next page is not tracked if not specified
+
+        Yields
+        ------
+        tuple
+            request response or chunk of records, cursor of the next page (None after the last page)
+            or end-of-page-unknown marker
+
+        Returns
+        -------
+        Response object or JSONStream
+            page to compute parameters of the next page from
+
+        """
+        if not self.stream:
+            yield response, self.next_cursor(params, response)
+            return response
+        page = JSONStream(response, self.creds['transform_keys']['json_key'], self.paginator.body_keys,
+                          self.chunk_size)
+        previous = None
+        for chunk in page.iter_chunks():
+            if previous is not None:
+                yield previous, _MID_PAGE
+            previous = chunk
+        yield previous or [], self.next_cursor(params, page)
+        return page
+
+    def next_cursor(self, params, page):
+        if params is None:
+            return _MID_PAGE
+        next_params = self.paginator.next_params(params, page)
+        return self.paginator.get_cursor(next_params) if next_params else None
+
+    def start_params(self):
+        """Method for building request parameters of the first page. A resumed run continues request window
+        of the checkpoint, since extract_keys resolved again (dates, watermark) may describe another window
+
+        Returns
+        -------
+        dict
+            request parameters
+
+        """
+        params = deepcopy(self.creds['extract_keys'])
+        checkpoint = self.checkpoints.load(self.name) if self.resume and self.checkpoints else None
+        if checkpoint and checkpoint['window'] != request_window(params):
+            logging.warning(f"{self.name} is resumed in request window of checkpoint {checkpoint['window']}")
+            params = {**params, **deepcopy(checkpoint['window'])}
+        self.window = request_window(params)
+        if checkpoint:
+            params = self.paginator.set_cursor(params, checkpoint['cursor'])
+        if self.stream:
+            params['stream'] = True
+        return params
+
+    def extract_pages(self):
+        """Method for iterating over API pages. Parameters of the next page are computed from the previous response.
+        If the paginator knows all remaining pages after the first response, they are fetched concurrently
+
+        Yields
+        ------
+        tuple
+            request response or chunk of records, cursor of the next page
+
+        """
+        params = self.start_params()
+        while params:
+            extractor = self.extractor(request_func=self.request_func, params=params,
+                                       rate_limiter=self.rate_limiter)
+            response = extractor.run_requests()
+            page = yield from self.emit_page(response, params)
+            if self.concurrency > 1 and hasattr(self.paginator, 'remaining_params'):
+                logging.info(f"Fetching remaining pages with {self.concurrency} parallel requests")
+                remaining_params, tracked_params = tee(self.paginator.remaining_params(params, page))
+                for response in extractor.run_concurrent_requests(remaining_params, self.concurrency, self.ordered):
+                    yield from self.emit_page(response, next(tracked_params) if self.ordered else None)
+                return
+            params = self.paginator.next_params(params, page)
+
+    def extraction_stage(self, out_queue):
+        for item in self.extract_pages():
+            if not self.put(out_queue, item):
+                return
+        self.put(out_queue, _DONE)
+
+    def transformation_stage(self, in_queue, out_queue):
+        while (item := self.get(in_queue)) is not _DONE:
+            response, cursor = item
+            transformer = self.transformer(raw_data=response, creds=self.creds['transform_keys'])
+            data = transformer.run_transformation()
+            if self.spool:
+                data = self.spool.write(data)
+            if not self.put(out_queue, (data, cursor)):
+                return
+        self.put(out_queue, _DONE)
+
+    def commit_loaded(self):
+        """Method for merging staging table into destination table in merge load mode. Spooled pages
+        merged into destination table are marked as loaded
+
+        """
+        if self.creds['load_keys'].get('load_mode') == 'merge':
+            self.loader(data=None, creds=self.creds['load_keys'], session=self.loader_session).execute_merge()
+            self.release_spooled()
+
+    def commit_flush(self):
+        """Method for committing loaded buffer. Waits for load jobs in flight when pages are spooled or
+        checkpoints are saved, so neither runs ahead of data in BigQuery. Outside merge mode spooled pages
+        of the buffer are marked as loaded, so replay after a failed run does not load them again.
+        In merge mode the staging table is durable and merged by the resumed run, spooled pages
+        are marked as loaded after merge
+
+        """
+        release = bool(self.spool and self.spooled) and self.creds['load_keys'].get('load_mode') != 'merge'
+        checkpoint = bool(self.checkpoints) and self.cursor is not _MID_PAGE
+        if not (release or checkpoint):
+            return
+        loader = self.loader(data=None, creds=self.creds['load_keys'], session=self.loader_session)
+        if hasattr(loader, 'finish_loading'):
+            self.load_jobs.extend(loader.finish_loading())
+        if release:
+            self.release_spooled()
+        if checkpoint:
+            if self.cursor is not None:
+                self.checkpoints.save(self.name, self.cursor, self.window)
+            self.cursor = _MID_PAGE
+
+    def release_spooled(self):
+        if self.spool and self.spooled:
+            self.spool.mark_loaded(self.spooled)
+            self.spooled = []
+
+    @ErrorDecorator.sys_error_decorator
+    def flush(self, buffer):
+        """Method for loading buffered pages as a single load
+
+        Returns
+        -------
+        pandas DataFrame
+            loaded data
+
+        """
+        data = buffer.drain()
+        self.track_watermark(data)
+        loader = self.loader(data=data, creds=self.creds['load_keys'], session=self.loader_session)
+        loader.execute_loading()
+        self.loads += 1
+        self.rows += len(data)
+        logging.info(f"Load {self.loads} finished, {self.pages} pages loaded")
+        return data
+
+    def track_watermark(self, data):
+        """Method for tracking max value of date column among loaded rows
+
+        """
+        if not self.watermarks:
+            return
+        date_col = self.creds['watermark_keys'].get('date_col') or self.creds['load_keys']['date_col']
+        if date_col not in data or data.empty:
+            return
+        latest = pd.to_datetime(data[date_col], errors='coerce', utc=True, format='ISO8601').max()
+        if pd.notna(latest) and (self.watermark is None or latest > self.watermark):
+            self.watermark = latest
+
+    def loading_stage(self, in_queue):
+        load_keys = self.creds['load_keys']
+        buffer = PageBuffer(buffer_rows=load_keys.get('buffer_rows') or 0,
+                            buffer_bytes=load_keys.get('buffer_bytes') or 0,
+                            buffer_seconds=load_keys.get('buffer_seconds') or 0)
+        merge_every = load_keys.get('merge_every') or 0
+        merged_pages = 0
+        while (item := self.get(in_queue)) is not _DONE:
+            data, cursor = item
+            if self.spool:
+                self.spooled.append(data)
+                data = self.spool.read(data)
+            buffer.add(data)
+            self.pages += 1
+            if cursor is not _MID_PAGE:
+                self.cursor = cursor
+            if not buffer.is_full():
+                continue
+            self.flush(buffer)
+            self.commit_flush()
+            if merge_every and self.pages - merged_pages >= merge_every:
+                self.commit_loaded()
+                merged_pages = self.pages
+        if self.stop_event.is_set():
+            return
+        if buffer:
+            self.flush(buffer)
+        if not merge_every or self.pages > merged_pages:
+            self.commit_loaded()
+        loader = self.loader(data=None, creds=load_keys, session=self.loader_session)
+        if hasattr(loader, 'finish_loading'):
+            self.load_jobs.extend(loader.finish_loading())
+        self.release_spooled()
+        if self.checkpoints and self.name:
+            self.checkpoints.clear(self.name)
+        if self.watermarks and self.watermark is not None:
+            self.watermarks.save(self.name, self.watermark.isoformat())
+
+    def run_stage(self, stage, *queues):
+        """Method for running pipeline stage in a thread. Stops other stages if the stage fails
+
+        """
+        Metrics.set_pipeline(self.name or '')
+        try:
+            stage(*queues)
+        except Exception:
+            self.errors.append(sys.exc_info()[1])
+            self.stop_event.set()
+
+    @ErrorDecorator.sys_error_decorator
+    def run(self):
+        """Method for running extraction, transformation and loading stages concurrently. With spool
+        the queue of transformed pages is unbounded, since it holds paths of spooled pages only
+
+        Returns
+        -------
+        dict
+            run statistics
+
+        """
+        Metrics.set_pipeline(self.name or '')
+        extracted = Queue(maxsize=self.queue_size)
+        transformed = Queue(maxsize=0 if self.spool else self.queue_size)
+        threads = [
+            threading.Thread(target=self.run_stage, args=(self.extraction_stage, extracted), daemon=True),
+            threading.Thread(target=self.run_stage, args=(self.transformation_stage, extracted, transformed),
+                             daemon=True),
+            threading.Thread(target=self.run_stage, args=(self.loading_stage, transformed), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return self.stats()
+
+    @ErrorDecorator.sys_error_decorator
+    def replay(self):
+        """Method for loading pending pages of the spool without requests to API. Checkpoint of the pipeline
+        is left untouched, since replay does not advance pagination
+
+        Returns
+        -------
+        dict
+            run statistics
+
+        """
+        Metrics.set_pipeline(self.name or '')
+        self.checkpoints = None
+        self.watermarks = None
+        spooled = Queue()
+        for path in self.spool.pending():
+            spooled.put((path, _MID_PAGE))
+        spooled.put(_DONE)
+        logging.info(f"Replaying {spooled.qsize() - 1} pages from {self.spool.directory}")
+        self.loading_stage(spooled)
+        return self.stats()
+
+    def stats(self):
+        logging.info(f"Pipeline finished, {self.pages} pages loaded with {self.loads} loads")
+        return {'pages': self.pages, 'loads': self.loads, 'rows': self.rows, 'load_jobs': self.load_jobs}
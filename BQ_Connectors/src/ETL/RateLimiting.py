@@ -0,0 +1,242 @@
+"""Classes for API rate limiting
+
+Token buckets per API host driven by rate-limit response headers and exponential backoff with jitter
+
+Author: Anton Popkov
+
+"""
+
+import re
+import random
+import logging
+import threading
+from time import monotonic, sleep, time
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from src.ETL.Decorator import ErrorDecorator
+
+REMAINING_HEADERS = ('X-RateLimit-Remaining', 'X-Rate-Limit-Remaining', 'RateLimit-Remaining')
+RESET_HEADERS = ('X-RateLimit-Reset', 'X-Rate-Limit-Reset', 'RateLimit-Reset')
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def header_number(headers, names):
+    """Function for reading the first number from one of rate-limit headers ('7', '7 seconds', '7.5')
+
+    Returns
+    -------
+    float or None
+        header value
+
+    """
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            match = re.search(r'\d+(\.\d+)?', str(value))
+            if match:
+                return float(match.group())
+    return None
+
+
+def retry_after_seconds(headers):
+    """Function for parsing Retry-After header given either in seconds or as HTTP date
+
+    Returns
+    -------
+    float or None
+        seconds to wait before the next request
+
+    """
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Class for token bucket limiting request rate to a single API host
+
+    Parameters
+    ----------
+
+    rate : float
+        tokens added per second
+    capacity : float
+        max number of tokens, i.e. allowed burst of requests
+    min_rate : float
+        lower bound of the rate adapted from response headers
+
+    """
+
+    def __init__(self, rate, capacity, min_rate=0.1):
+        self.rate = rate
+        self.max_rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Method for taking a token. Blocks until a token is available and the host is not paused
+
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            sleep(wait_time)
+
+    def pause(self, seconds):
+        """Method for blocking all requests to the host, e.g. after 429 response
+
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+            self.tokens = 0
+
+    def adapt(self, remaining, reset):
+        """Method for spreading remaining request budget evenly until the limit window resets
+
+        Parameters
+        ----------
+        remaining : float
+            number of requests left in the current window
+        reset : float
+            seconds until the window resets
+
+        """
+        if remaining is None:
+            return
+        reset = reset or 60.0
+        if remaining < 1:
+            self.pause(reset)
+            return
+        with self.lock:
+            self.rate = min(max(remaining / reset, self.min_rate), self.max_rate)
+
+
+class RateLimiter(ErrorDecorator):
+    """Class for rate limiting and retry policy of requests to API hosts
+
+    Parameters
+    ----------
+
+    rate : float
+        default number of requests per second to a host
+    capacity : float
+        default burst of requests to a host
+    hosts : dict
+        rate and capacity overrides per host
+    max_tries : int
+        number of tries for 429/5xx responses and timeouts
+    backoff_base : float
+        base delay of exponential backoff in seconds
+    backoff_cap : float
+        max delay of exponential backoff in seconds
+
+    """
+
+    def __init__(self, rate=10, capacity=10, hosts=None, max_tries=5, backoff_base=1, backoff_cap=60):
+        super().__init__()
+        self.rate = rate
+        self.capacity = capacity
+        self.hosts = hosts or {}
+        self.max_tries = max_tries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        """Method for getting token bucket of API host
+
+        Parameters
+        ----------
+        url : str
+            request url
+
+        Returns
+        -------
+        TokenBucket
+            bucket of the url host
+
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                limits = {'rate': self.rate, 'capacity': self.capacity, **self.hosts.get(host, {})}
+                self.buckets[host] = TokenBucket(**limits)
+            return self.buckets[host]
+
+    def update(self, url, headers):
+        """Method for adapting rate of the host to rate-limit response headers
+
+        """
+        remaining = header_number(headers, REMAINING_HEADERS)
+        reset = header_number(headers, RESET_HEADERS)
+        if reset and reset > 1e9:
+            reset = max(reset - time(), 0.0)
+        self.bucket(url).adapt(remaining, reset)
+
+    def backoff(self, attempt, retry_after=None):
+        """Method for computing delay before retry. Retry-After is respected, otherwise exponential backoff
+        with full jitter is used
+
+        Parameters
+        ----------
+        attempt : int
+            number of the failed try starting from 0
+        retry_after : float
+            delay requested by server
+
+        Returns
+        -------
+        float
+            seconds to wait
+
+        """
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+
+def shared_rate_limiter(**params):
+    """Function for getting rate limiter shared by all pipelines of the process
+
+    Parameters
+    ----------
+    params : dict
+        RateLimiter parameters, used on the first call only
+
+    Returns
+    -------
+    RateLimiter
+        shared limiter
+
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(**params)
+            logging.info("Rate limiter created")
+        return _limiter
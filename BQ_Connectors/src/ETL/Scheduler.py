@@ -0,0 +1,125 @@
+"""Classes for scheduling pipelines
+
+Concurrent execution of all pipelines from config.yaml with global and per-host limits
+
+Author: Anton Popkov
+
+"""
+
+import logging
+from time import monotonic
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.ETL import Metrics
+from src.ETL.Decorator import ErrorDecorator
+
+
+def find_pipelines(creds):
+    """Function for listing pipeline sections of config.yaml
+
+    Parameters
+    ----------
+    creds : dict
+        config.yaml
+
+    Returns
+    -------
+    list
+        names of *_creds sections with extract_keys
+
+    """
+    return [key for key, value in creds.items()
+            if key.endswith('_creds') and isinstance(value, dict) and 'extract_keys' in value]
+
+
+def pipeline_host(creds, key_ind):
+    return urlparse(creds[key_ind]['extract_keys']['url']).netloc
+
+
+class PipelineScheduler(ErrorDecorator):
+    """Class for running pipelines concurrently. A pipeline starts as soon as a worker is free and its API host
+    has fewer running pipelines than the host limit, so the whole run takes about as long as the longest
+    source instead of the sum of all sources. A failed pipeline does not stop the others
+
+    Parameters
+    ----------
+
+    creds : dict
+        config.yaml
+    run_func : func
+        function running a single pipeline, called as run_func(creds=creds, key_ind=key_ind, **run_params)
+    pipelines : list
+        names of pipelines to run, all pipelines from config.yaml if not specified
+    max_workers : int
+        max number of pipelines running at the same time
+    per_host : int
+        default max number of running pipelines per API host
+    hosts : dict
+        API host and its max number of running pipelines
+    run_params : dict
+        shared resources passed to every pipeline (session, bq_session, resume)
+
+    """
+
+    def __init__(self, creds, run_func, pipelines=None, max_workers=4, per_host=2, hosts=None, **run_params):
+        super().__init__()
+        self.creds = creds
+        self.run_func = run_func
+        self.pipelines = pipelines or find_pipelines(creds)
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.hosts = hosts or {}
+        self.run_params = run_params
+        self.summary = {}
+
+    def host_limit(self, host):
+        return max(self.hosts.get(host, self.per_host), 1)
+
+    def run_pipeline(self, key_ind):
+        """Method for running a pipeline and recording its result
+
+        """
+        start = monotonic()
+        Metrics.set_pipeline(key_ind)
+        logging.info(f"Pipeline {key_ind} started")
+        try:
+            result = self.run_func(creds=self.creds, key_ind=key_ind, **self.run_params) or {}
+            self.summary[key_ind] = {'status': 'ok', **{k: v for k, v in result.items() if k != 'load_jobs'}}
+        except Exception as error:
+            logging.error(f"Pipeline {key_ind} failed: {error!r}")
+            self.summary[key_ind] = {'status': 'failed', 'error': repr(error)}
+        self.summary[key_ind]['seconds'] = round(monotonic() - start, 1)
+
+    @ErrorDecorator.sys_error_decorator
+    def run(self):
+        """Method for running all pipelines
+
+        Returns
+        -------
+        dict
+            pipeline name and its status, statistics and duration
+
+        """
+        pending = list(self.pipelines)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for key_ind in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    host = pipeline_host(self.creds, key_ind)
+                    if sum(h == host for h in running.values()) >= self.host_limit(host):
+                        continue
+                    pending.remove(key_ind)
+                    running[executor.submit(self.run_pipeline, key_ind)] = host
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+        self.log_summary()
+        return self.summary
+
+    def log_summary(self):
+        failed = [key for key, result in self.summary.items() if result['status'] != 'ok']
+        for key_ind, result in self.summary.items():
+            logging.info(f"{key_ind}: {result}")
+        logging.info(f"{len(self.summary) - len(failed)} pipelines finished, {len(failed)} failed: {failed}")
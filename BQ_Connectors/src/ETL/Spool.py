@@ -0,0 +1,179 @@
+"""Classes for spooling pages
+
+Local spool of transformed pages between transformation and loading for replay and decoupled loading
+
+Author: Anton Popkov
+
+"""
+
+import os
+import logging
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime
+from src.ETL.Decorator import ErrorDecorator
+from src.ETL.Loading import to_pandas
+
+PENDING_SUFFIX = '.parquet'
+LOADED_SUFFIX = '.loaded'
+
+
+class PageSpool(ErrorDecorator):
+    """Class for spooling transformed pages into compressed Parquet files. Spool directory is laid out as
+    <path>/<key_ind>/<run_id>/page_<n>.parquet, loaded pages are renamed to .loaded or removed. Loaded pages
+    are evicted when spool exceeds max_bytes, pending pages of any run are kept for replay
+
+    Parameters
+    ----------
+
+    path : str
+        spool root directory
+    key_ind : str
+        pipeline name from config.yaml
+    run_id : str
+        run directory name, current time if not specified
+    max_bytes : int
+        max size of spool root directory, no eviction if 0
+    keep_loaded : bool
+        flag for keeping loaded pages until eviction
+    compression : str
+        parquet compression codec
+
+    """
+
+    def __init__(self, path, key_ind, run_id=None, max_bytes=0, keep_loaded=False, compression='zstd'):
+        super().__init__()
+        self.path = path
+        self.key_ind = key_ind
+        self.run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.directory = os.path.join(path, key_ind, self.run_id)
+        self.max_bytes = max_bytes
+        self.keep_loaded = keep_loaded
+        self.compression = compression
+        self.pages = len(self.pending()) if os.path.isdir(self.directory) else 0
+        self.over_limit = False
+        self.lock = threading.Lock()
+
+    @ErrorDecorator.sys_error_decorator
+    def write(self, data):
+        """Method for writing transformed page into spool. File appears atomically under its final name
+
+        Parameters
+        ----------
+        data : dask.DataFrame, pyarrow.Table or pandas.DataFrame
+            transformed page
+
+        Returns
+        -------
+        str
+            path of spooled page
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(to_pandas(data), preserve_index=False)
+        with self.lock:
+            self.pages += 1
+            path = os.path.join(self.directory, f"page_{self.pages:06d}{PENDING_SUFFIX}")
+        pq.write_table(table, f"{path}.tmp", compression=self.compression)
+        os.replace(f"{path}.tmp", path)
+        self.evict()
+        return path
+
+    @staticmethod
+    def read(path):
+        """Method for reading spooled page
+
+        Parameters
+        ----------
+        path : str
+            path of spooled page
+
+        Returns
+        -------
+        pandas DataFrame
+            page data
+
+        """
+        return pq.read_table(path, memory_map=True).to_pandas()
+
+    def mark_loaded(self, paths):
+        """Method for marking spooled pages as loaded
+
+        Parameters
+        ----------
+        paths : list
+            paths of spooled pages
+
+        """
+        for path in paths:
+            if self.keep_loaded:
+                os.replace(path, path[:-len(PENDING_SUFFIX)] + LOADED_SUFFIX)
+            else:
+                os.remove(path)
+        logging.info(f"{len(paths)} spooled pages marked as loaded")
+
+    def pending(self):
+        """Method for listing pages of the run which are not loaded yet
+
+        Returns
+        -------
+        list
+            paths of pending pages in order of writing
+
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(PENDING_SUFFIX))
+
+    @staticmethod
+    def runs(path, key_ind):
+        """Method for listing spooled runs of a pipeline
+
+        Returns
+        -------
+        list
+            run ids from the oldest to the newest
+
+        """
+        directory = os.path.join(path, key_ind)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+    def evict(self):
+        """Method for removing loaded pages, the oldest first, and directories of finished runs while spool
+        is larger than max_bytes. Pending pages and pages being written are never removed, spool stays
+        over the limit with a warning instead
+
+        """
+        if not self.max_bytes:
+            return
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                files.append((name.endswith(LOADED_SUFFIX), stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, _, size, _ in files)
+        for _, _, size, path in sorted(item for item in files if item[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        for directory in {os.path.dirname(path) for loaded, _, _, path in files if loaded}:
+            if directory != self.directory:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        if total > self.max_bytes and not self.over_limit:
+            logging.warning(f"Spool {self.path} is {total} bytes, over max_bytes {self.max_bytes}, "
+                            f"only pending pages left")
+        self.over_limit = total > self.max_bytes
@@ -0,0 +1,166 @@
+"""Classes for pipeline state
+
+Local JSON stores of pipeline state persisted between runs
+
+Author: Anton Popkov
+
+"""
+
+import os
+import json
+import fcntl
+import logging
+import threading
+import pandas as pd
+from contextlib import contextmanager
+from src.ETL.Decorator import ErrorDecorator
+
+
+class JSONStateStore(ErrorDecorator):
+    """Class for storing pipeline state in a local JSON file. Writes are atomic and serialized between
+    threads and processes with a lock file
+
+    Parameters
+    ----------
+
+    path : str
+        path of JSON file
+
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self.lock, open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self):
+        """Method for reading the whole state
+
+        Returns
+        -------
+        dict
+            state
+
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as file:
+            return json.load(file)
+
+    def write(self, state):
+        with open(f"{self.path}.tmp", 'w') as file:
+            json.dump(state, file, indent=2, default=str)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    @ErrorDecorator.sys_error_decorator
+    def get(self, key, default=None):
+        with self.locked():
+            return self.read().get(key, default)
+
+    @ErrorDecorator.sys_error_decorator
+    def set(self, key, value):
+        with self.locked():
+            state = self.read()
+            state[key] = value
+            self.write(state)
+
+    @ErrorDecorator.sys_error_decorator
+    def delete(self, key):
+        with self.locked():
+            state = self.read()
+            if state.pop(key, None) is not None:
+                self.write(state)
+
+
+class CheckpointStore(JSONStateStore):
+    """Class for storing pagination cursor of the last committed page per pipeline together with request window
+    of the run, so a resumed run continues the same window
+
+    """
+
+    def save(self, key_ind, cursor, window=None):
+        """Method for saving cursor of the page to resume from
+
+        Parameters
+        ----------
+        key_ind : str
+            pipeline name from config.yaml
+        cursor : dict
+            pagination cursor
+        window : dict
+            resolved request parameters of the run without headers
+
+        """
+        self.set(key_ind, {'cursor': cursor, 'window': window})
+        logging.info(f"Checkpoint of {key_ind} saved at {cursor}")
+
+    def load(self, key_ind):
+        """Method for loading checkpoint of a pipeline. Checkpoints saved without request window are discarded,
+        since their window can not be restored
+
+        Returns
+        -------
+        dict
+            cursor and window, None if there is no checkpoint
+
+        """
+        checkpoint = self.get(key_ind)
+        if checkpoint is not None and 'window' not in checkpoint:
+            logging.warning(f"Checkpoint of {key_ind} has no request window, discarded")
+            return None
+        if checkpoint is not None:
+            logging.info(f"Resuming {key_ind} from {checkpoint['cursor']}")
+        return checkpoint
+
+    def clear(self, key_ind):
+        self.delete(key_ind)
+        logging.info(f"Checkpoint of {key_ind} cleared")
+
+
+class WatermarkStore(JSONStateStore):
+    """Class for storing max value of date column loaded per pipeline, start of the next incremental window
+
+    """
+
+    def load(self, key_ind):
+        return self.get(key_ind)
+
+    def save(self, key_ind, watermark):
+        """Method for moving watermark forward. Watermark never moves back unless it is reset
+
+        Parameters
+        ----------
+        key_ind : str
+            pipeline name from config.yaml
+        watermark : str
+            max value of date column in ISO format with UTC offset
+
+        """
+        with self.locked():
+            state = self.read()
+            if state.get(key_ind) is None or pd.Timestamp(watermark) > pd.Timestamp(state[key_ind]):
+                state[key_ind] = watermark
+                self.write(state)
+        logging.info(f"Watermark of {key_ind} is {self.load(key_ind)}")
+
+    def reset(self, key_ind, watermark=None):
+        """Method for resetting watermark for backfills. Window starts from the initial offset if watermark
+        is not specified
+
+        """
+        if watermark is None:
+            self.delete(key_ind)
+        else:
+            self.set(key_ind, pd.to_datetime(watermark, utc=True).isoformat())
+        logging.info(f"Watermark of {key_ind} reset to {watermark}")
@@ -0,0 +1,93 @@
+"""Classes for streaming responses
+
+Incremental parsing of large API responses into fixed-size chunks of records
+
+Author: Anton Popkov
+
+"""
+
+import logging
+from src.ETL.Decorator import ErrorDecorator
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+SCALAR_EVENTS = ('null', 'boolean', 'integer', 'double', 'number', 'string')
+
+
+class JSONStream(ErrorDecorator):
+    """Class for parsing response body incrementally. Records under json_key are yielded in chunks, top-level
+    keys needed for pagination are collected in the same pass, so the body is neither held in memory nor
+    parsed twice. Exposes json() and headers of parsed page for pagination strategies
+
+    Parameters
+    ----------
+
+    response : Response object
+        API response requested with stream=True
+    json_key : str
+        key with records, records are expected at the top level if empty
+    meta_keys : iterable
+        top-level keys to collect, e.g. next_page or pagination_token
+    chunk_size : int
+        number of records in a chunk
+
+    """
+
+    def __init__(self, response, json_key, meta_keys=(), chunk_size=5000):
+        super().__init__()
+        if ijson is None:
+            raise ImportError("ijson is required for streaming responses")
+        self.response = response
+        self.headers = response.headers
+        self.item_prefix = f"{json_key}.item" if json_key else 'item'
+        self.meta_keys = set(meta_keys)
+        self.chunk_size = chunk_size
+        self.meta = {}
+
+    def json(self):
+        """Method for getting top-level keys collected while parsing
+
+        Returns
+        -------
+        dict
+            collected keys
+
+        """
+        return self.meta
+
+    def iter_chunks(self):
+        """Method for parsing response body into chunks of records
+
+        Yields
+        ------
+        list
+            records
+
+        """
+        self.response.raw.decode_content = True
+        chunk, builder, records = [], None, 0
+        for prefix, event, value in ijson.parse(self.response.raw, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == self.item_prefix and event in ('end_map', 'end_array'):
+                    chunk.append(builder.value)
+                    builder = None
+            elif prefix == self.item_prefix:
+                if event in ('start_map', 'start_array'):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                else:
+                    chunk.append(value)
+            elif prefix in self.meta_keys and event in SCALAR_EVENTS:
+                self.meta[prefix] = value
+            if len(chunk) >= self.chunk_size:
+                records += len(chunk)
+                yield chunk
+                chunk = []
+        if chunk:
+            records += len(chunk)
+            yield chunk
+        logging.info(f"{records} records parsed from response stream")
@@ -8,7 +8,8 @@ Author: Anton Popkov
 
 import logging
 import pandas as pd
-import dask.dataframe as dd
+import pyarrow as pa
+from datetime import datetime
 from src.ETL.Interfaces import Transformation
 
 
@@ -32,7 +33,8 @@ class TransformationDask(Transformation):
     @Transformation.sys_error_decorator
     def format_response(self):
         """Method for converting response object into json. Returns data from json
-        if key with data specified and actual json otherwise
+        if key with data specified and actual json otherwise. Chunks of records parsed from streamed
+        response are returned as is
 
         Returns
         -------
@@ -41,7 +43,9 @@ class TransformationDask(Transformation):
             response json
 
         """
-        if self.creds['json_key']:
+        if isinstance(self.raw_data, list):
+            json_file = self.raw_data
+        elif self.creds['json_key']:
             json_file = self.raw_data.json()[self.creds['json_key']]
         else:
             json_file = self.raw_data.json()
@@ -82,6 +86,7 @@ class TransformationDask(Transformation):
             dataframe with response data
 
         """
+        import dask.dataframe as dd
         dd_df = dd.from_pandas(pd.DataFrame(data, dtype=str), npartitions=1)
         return dd_df
 
@@ -102,3 +107,146 @@ class TransformationDask(Transformation):
         dd_df[self.creds['created_on_col']] = pd.Timestamp.today()
         logging.info("Transformation has been successful")
         return dd_df
+
+
+class TransformationArrow(Transformation):
+    """Class for flattening requests API responses straight into columnar Arrow table
+
+    Parameters
+    ----------
+
+    raw_data : response object
+        API response object
+    creds : dict
+        params for transformation
+
+    """
+
+    def __init__(self, raw_data, creds):
+        self.raw_data = raw_data
+        self.creds = creds
+
+    @Transformation.sys_error_decorator
+    def format_response(self):
+        """Method for converting response object into json. Returns data from json
+        if key with data specified and actual json otherwise. Chunks of records parsed from streamed
+        response are returned as is
+
+        Returns
+        -------
+
+        list
+            response records
+
+        """
+        if isinstance(self.raw_data, list):
+            json_file = self.raw_data
+        elif self.creds['json_key']:
+            json_file = self.raw_data.json()[self.creds['json_key']]
+        else:
+            json_file = self.raw_data.json()
+        return json_file
+
+    def flatten_record(self, record, prefix=''):
+        """Method for flattening nested dict the same way as pandas.json_normalize, so both engines produce
+        the same schema. Empty dicts are dropped, values of nested dicts follow plain values and replace them
+        when flattened names collide
+
+        Parameters
+        ----------
+        record : dict
+            nested API record
+        prefix : str
+            column name of the parent dict followed by separator
+
+        Returns
+        -------
+
+        dict
+            column name and value
+
+        """
+        flat = {prefix + str(key): value for key, value in record.items()}
+        for key, value in record.items():
+            if isinstance(value, dict):
+                column = prefix + str(key)
+                flat.pop(column)
+                flat.update(self.flatten_record(value, column + self.creds['separator']))
+        return flat
+
+    @Transformation.sys_error_decorator
+    def to_columns(self, file):
+        """Method for flattening response records into columns. Columns missing in a record are filled with nulls,
+        values are cast to strings
+
+        Parameters
+        ----------
+        file : list
+            API response records
+
+        Returns
+        -------
+
+        dict
+            column name and list of values
+
+        """
+        if isinstance(file, dict):
+            file = [file]
+        columns = {}
+        for row, record in enumerate(file):
+            flat = self.flatten_record(record)
+            for column, value in flat.items():
+                values = columns.get(column)
+                if values is None:
+                    values = columns[column] = [None] * row
+                values.append(None if value is None else str(value))
+            if len(flat) < len(columns):
+                for values in columns.values():
+                    if len(values) == row:
+                        values.append(None)
+        return columns
+
+    @Transformation.sys_error_decorator
+    def to_arrow(self, columns):
+        """Method for building Arrow table of strings from columns
+
+        Parameters
+        ----------
+        columns : dict
+            column name and list of values
+
+        Returns
+        -------
+
+        pyarrow Table
+            table with response data
+
+        """
+        table = pa.table({column: pa.array(values, type=pa.string()) for column, values in columns.items()})
+        return table
+
+    @Transformation.sys_error_decorator
+    def run_transformation(self):
+        """Method for sequential running of class transformation methods
+
+        Returns
+        -------
+
+        pyarrow Table
+            table with response data
+
+        """
+        json_file = self.format_response()
+        columns = self.to_columns(json_file)
+        table = self.to_arrow(columns)
+        created_on = pa.repeat(pa.scalar(datetime.now(), type=pa.timestamp('us')), table.num_rows)
+        table = table.append_column(self.creds['created_on_col'], created_on)
+        logging.info("Transformation has been successful")
+        return table
+
+
+TRANSFORMERS = {
+    'dask': TransformationDask,
+    'arrow': TransformationArrow,
+}
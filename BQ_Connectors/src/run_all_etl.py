@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""API ETL pipelines
+
+Runs all pipelines from config.yaml concurrently with a shared HTTP session, rate limiter and BigQuery client
+
+Author: Anton Popkov
+
+"""
+
+import os
+import sys
+import argparse
+from src.ETL import Metrics
+from src.utils.config import get_config
+from src.ETL.Extraction import shared_session
+from src.ETL.Loading import BQSession
+from src.ETL.Scheduler import PipelineScheduler
+from src.utils.request_funtions import run_pagination
+
+
+def run_etl():
+    parser = argparse.ArgumentParser(description='Run all ETL pipelines concurrently')
+    parser.add_argument('--pipelines', nargs='*', default=None, help='pipeline names, all pipelines if not specified')
+    parser.add_argument('--resume', action='store_true', help='continue from the last saved checkpoints')
+    parser.add_argument('--config', default=None, help='path of config.yaml, ETL_CONFIG env variable if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials['bq_creds']['json_creds_path']
+    scheduler_keys = dict(credentials.get('scheduler') or {})
+    session = shared_session(**(credentials.get('http_session') or {}))
+    bq_session = BQSession(max_in_flight=scheduler_keys.pop('max_in_flight', 8))
+    scheduler = PipelineScheduler(creds=credentials, run_func=run_pagination, pipelines=args.pipelines,
+                                  session=session, bq_session=bq_session, resume=args.resume, **scheduler_keys)
+    summary = scheduler.run()
+    session.close()
+    Metrics.finish_run()
+    if any(result['status'] != 'ok' for result in summary.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_etl()
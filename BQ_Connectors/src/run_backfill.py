@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Backfill
+
+Loads historical data of a pipeline split into date windows running in parallel processes
+
+Author: Anton Popkov
+
+"""
+
+import os
+import sys
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.utils.config import get_config
+from src.utils.dynamic_params import date_windows
+from src.utils.request_funtions import backfill_shard, check_backfill_deletes
+
+
+def run_backfill():
+    parser = argparse.ArgumentParser(description='Backfill pipeline by date windows in parallel processes')
+    parser.add_argument('--key-ind', required=True, help='pipeline name from config.yaml')
+    parser.add_argument('--start', required=True, help='start of range, e.g. 2024-01-01')
+    parser.add_argument('--end', required=True, help='end of range, not included')
+    parser.add_argument('--days', type=int, default=1, help='length of window in days')
+    parser.add_argument('--workers', type=int, default=4, help='number of parallel processes')
+    parser.add_argument('--no-sharding', action='store_true', help='load into destination table without suffix')
+    parser.add_argument('--resume', action='store_true', help='continue shards from their checkpoints')
+    parser.add_argument('--config', default=None, help='path of config.yaml, ETL_CONFIG env variable if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials['bq_creds']['json_creds_path']
+    check_backfill_deletes(credentials[args.key_ind]['load_keys'])
+    windows = date_windows(args.start, args.end, args.days)
+    logging.info(f"Backfill of {args.key_ind}: {len(windows)} windows with {args.workers} workers")
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(backfill_shard, credentials, args.key_ind, start, finish,
+                                   not args.no_sharding, args.workers, args.resume): start
+                   for start, finish in windows}
+        for future in as_completed(futures):
+            start = futures[future]
+            try:
+                result = future.result()
+                logging.info(f"Window {start:%Y-%m-%d} loaded: {result['pages']} pages, {result['rows']} rows")
+            except Exception as error:
+                logging.error(f"Window {start:%Y-%m-%d} failed: {error!r}")
+                failed.append(f"{start:%Y-%m-%d}")
+    logging.info(f"Backfill finished, {len(windows) - len(failed)} windows loaded, failed: {failed}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_backfill()
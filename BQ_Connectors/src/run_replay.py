@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""Spool replay
+
+Loads spooled pages of a pipeline into BigQuery without requests to API
+
+Author: Anton Popkov
+
+"""
+
+import os
+import argparse
+from src.ETL import Metrics
+from src.utils.config import get_config
+from src.utils.request_funtions import replay_spool
+
+
+def run_replay():
+    parser = argparse.ArgumentParser(description='Load spooled pages without requests to API')
+    parser.add_argument('--key-ind', required=True, help='pipeline name from config.yaml')
+    parser.add_argument('--run-id', default=None, help='spooled run to replay, all runs if not specified')
+    parser.add_argument('--config', default=None, help='path of config.yaml, ETL_CONFIG env variable if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials['bq_creds']['json_creds_path']
+    replay_spool(creds=credentials, key_ind=args.key_ind, run_id=args.run_id)
+    Metrics.finish_run()
+
+
+if __name__ == '__main__':
+    run_replay()
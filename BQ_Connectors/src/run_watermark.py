@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Watermarks
+
+Shows and resets watermarks of incremental pipelines, e.g. before a backfill
+
+Author: Anton Popkov
+
+"""
+
+import argparse
+from src.utils.config import get_config
+from src.ETL.State import WatermarkStore
+from src.utils.dynamic_params import watermark_window
+
+
+def run_watermark():
+    parser = argparse.ArgumentParser(description='Show or reset watermark of incremental pipeline')
+    parser.add_argument('--key-ind', required=True, help='pipeline name from config.yaml')
+    parser.add_argument('--reset', action='store_true', help='reset watermark, next run starts from initial_days')
+    parser.add_argument('--set', default=None, help='move watermark to the date, e.g. 2024-01-01')
+    parser.add_argument('--config', default=None, help='path of config.yaml, ETL_CONFIG env variable if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+    watermarks = WatermarkStore(**credentials['watermarks'])
+    if args.reset or args.set:
+        watermarks.reset(args.key_ind, args.set)
+    watermark = watermarks.load(args.key_ind)
+    start_date, finish_date = watermark_window(credentials[args.key_ind]['watermark_keys'], watermark)
+    print(f"{args.key_ind}: watermark {watermark}, next window {start_date} - {finish_date}")
+
+
+if __name__ == '__main__':
+    run_watermark()
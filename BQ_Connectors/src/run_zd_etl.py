@@ -8,14 +8,21 @@ Author: Anton Popkov
 """
 
 import os
-from src.ETL.Decorator import credentials
+import argparse
+from src.ETL import Metrics
+from src.utils.config import get_config
 from src.utils.request_funtions import pagination_zendesk
 
-os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials['bq_creds']['json_creds_path']
-
 
 def run_etl():
-    pagination_zendesk(creds=credentials, key_ind='zd_tickets_creds')
+    parser = argparse.ArgumentParser(description='Run ETL job')
+    parser.add_argument('--resume', action='store_true', help='continue from the last saved checkpoint')
+    parser.add_argument('--config', default=None, help='path of config.yaml, ETL_CONFIG env variable if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials['bq_creds']['json_creds_path']
+    pagination_zendesk(creds=credentials, key_ind='zd_tickets_creds', resume=args.resume)
+    Metrics.finish_run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,174 @@
+"""BigQuery types
+
+Inference of BigQuery column types and serialization of typed pages into Parquet
+
+Author: Anton Popkov
+
+"""
+
+import io
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api import types
+
+ARROW_TYPES = {
+    'STRING': pa.string(),
+    'INTEGER': pa.int64(),
+    'INT64': pa.int64(),
+    'FLOAT': pa.float64(),
+    'FLOAT64': pa.float64(),
+    'BOOLEAN': pa.bool_(),
+    'BOOL': pa.bool_(),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+    'DATETIME': pa.timestamp('us'),
+    'DATE': pa.date32(),
+}
+
+INTEGER_PATTERN = re.compile(r'^-?\d{1,18}$')
+LEADING_ZERO_PATTERN = re.compile(r'^[+-]?0\d')
+PLUS_PATTERN = re.compile(r'^\s*\+')
+TZ_PATTERN = re.compile(r'(?:Z|[+-]\d{2}:?\d{2})$')
+BOOLEANS = {'true': True, 'false': False}
+
+
+def infer_type(series):
+    """Function for inferring BigQuery type of a column. String values are checked for booleans, integers,
+    floats, dates and timestamps, values with leading zeros or plus sign (phones) are kept as strings
+
+    Parameters
+    ----------
+    series : pandas Series
+        column values
+
+    Returns
+    -------
+    str
+        BigQuery type
+
+    """
+    if types.is_bool_dtype(series):
+        return 'BOOLEAN'
+    if types.is_integer_dtype(series):
+        return 'INTEGER'
+    if types.is_float_dtype(series):
+        return 'FLOAT'
+    if types.is_datetime64_any_dtype(series):
+        return 'TIMESTAMP' if getattr(series.dt, 'tz', None) else 'DATETIME'
+    values = series.dropna().astype(str)
+    if values.empty:
+        return 'STRING'
+    if values.str.lower().isin(BOOLEANS.keys()).all():
+        return 'BOOLEAN'
+    if not (values.str.match(LEADING_ZERO_PATTERN).any() or values.str.match(PLUS_PATTERN).any()):
+        if values.str.match(INTEGER_PATTERN).all():
+            return 'INTEGER'
+        if pd.to_numeric(values, errors='coerce').notna().all():
+            return 'FLOAT'
+    if values.str.len().min() >= 8 and pd.to_datetime(values, errors='coerce', utc=True,
+                                                     format='ISO8601').notna().all():
+        if values.str.contains(TZ_PATTERN).all():
+            return 'TIMESTAMP'
+        if (values.str.len() == 10).all():
+            return 'DATE'
+        return 'DATETIME'
+    return 'STRING'
+
+
+def check_cast(series, values, bq_type):
+    """Function for checking that every value of a column is cast. Empty strings are treated as nulls
+
+    Raises
+    ------
+    ValueError
+        if some values can not be cast
+
+    """
+    failed = series.notna() & (series.astype(str).str.strip() != '') & pd.Series(values, index=series.index).isna()
+    if failed.any():
+        raise ValueError(f"Column {series.name}: values {series[failed].unique()[:5].tolist()} can not be cast "
+                         f"to {bq_type}, declare column type in column_types")
+    return values
+
+
+def cast_column(series, bq_type):
+    """Function for casting column values to BigQuery type. Values which can not be cast raise an error
+    instead of becoming nulls
+
+    Parameters
+    ----------
+    series : pandas Series
+        column values
+    bq_type : str
+        BigQuery type
+
+    Returns
+    -------
+    pandas Series
+        cast values
+
+    """
+    if bq_type in ('INTEGER', 'INT64'):
+        values = check_cast(series, pd.to_numeric(series, errors='coerce'), bq_type)
+        if (values.dropna() % 1 != 0).any():
+            raise ValueError(f"Column {series.name}: fractional values can not be cast to {bq_type}")
+        return values.astype('Int64')
+    if bq_type in ('FLOAT', 'FLOAT64'):
+        return check_cast(series, pd.to_numeric(series, errors='coerce'), bq_type).astype('float64')
+    if bq_type in ('BOOLEAN', 'BOOL'):
+        if types.is_bool_dtype(series):
+            return series
+        return check_cast(series, series.astype(str).str.lower().map(BOOLEANS), bq_type).astype('boolean')
+    if bq_type in ('TIMESTAMP', 'DATETIME', 'DATE'):
+        if types.is_datetime64_any_dtype(series):
+            values = series.dt.tz_localize('UTC') if bq_type == 'TIMESTAMP' and not series.dt.tz else series
+        else:
+            values = check_cast(series, pd.to_datetime(series, errors='coerce', utc=True, format='ISO8601'), bq_type)
+        if bq_type == 'DATETIME' and values.dt.tz is not None:
+            values = values.dt.tz_localize(None)
+        return values.dt.date if bq_type == 'DATE' else values
+    return series.astype('string')
+
+
+def to_arrow(frame, column_types):
+    """Function for building Arrow table with explicit schema from pandas DataFrame
+
+    Parameters
+    ----------
+    frame : pandas DataFrame
+        page data
+    column_types : dict
+        column name and BigQuery type
+
+    Returns
+    -------
+    pyarrow Table
+        typed table
+
+    """
+    columns = {col: cast_column(frame[col], column_types[col]) for col in frame.columns}
+    schema = pa.schema([(col, ARROW_TYPES[column_types[col]]) for col in frame.columns])
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=schema, preserve_index=False)
+
+
+def to_parquet(table, compression='zstd'):
+    """Function for serializing Arrow table into compressed Parquet in memory
+
+    Parameters
+    ----------
+    table : pyarrow Table
+        typed table
+    compression : str
+        parquet compression codec
+
+    Returns
+    -------
+    BytesIO
+        parquet file
+
+    """
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=compression)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,160 @@
+"""Config
+
+Lazy loading of config.yaml. Path is taken from CLI, ETL_CONFIG environment variable or default location,
+parsed file is cached until its modification time changes. Dynamic parameters (!date, !zd_query and legacy
+python/object/apply tags of dynamic_params) are parsed safely and evaluated on every get_config call
+
+Author: Anton Popkov
+
+"""
+
+import os
+import yaml
+import logging
+import threading
+
+CONFIG_ENV = 'ETL_CONFIG'
+DEFAULT_PATH = '/<path>/src/config.yaml'
+RESOLVERS = {'!date': 'create_date', '!zd_query': 'create_zd_query'}
+APPLY_PREFIX = 'tag:yaml.org,2002:python/object/apply:src.utils.dynamic_params.'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class Resolver:
+    """Class for dynamic parameter of config, function from dynamic_params called on resolution
+
+    Parameters
+    ----------
+
+    name : str
+        function name
+    args : list
+        function arguments
+
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __call__(self):
+        from src.utils import dynamic_params
+        return getattr(dynamic_params, self.name)(*self.args)
+
+    def __repr__(self):
+        return f"Resolver({self.name}, {self.args})"
+
+
+class ConfigLoader(yaml.SafeLoader):
+    """Safe YAML loader with constructors of dynamic parameters only
+
+    """
+
+
+def construct_resolver(name):
+    def constructor(loader, node):
+        return Resolver(name, loader.construct_sequence(node, deep=True))
+
+    return constructor
+
+
+def construct_apply(loader, suffix, node):
+    """Function for reading legacy !!python/object/apply tags. Only functions of dynamic_params with resolvers
+    are allowed, nothing is executed while parsing
+
+    """
+    if suffix not in RESOLVERS.values():
+        raise yaml.constructor.ConstructorError(None, None, f"Function {suffix} is not allowed in config",
+                                                node.start_mark)
+    return Resolver(suffix, loader.construct_sequence(node, deep=True))
+
+
+for tag, function in RESOLVERS.items():
+    ConfigLoader.add_constructor(tag, construct_resolver(function))
+ConfigLoader.add_multi_constructor(APPLY_PREFIX, construct_apply)
+
+
+def set_config_path(path):
+    """Function for setting config path of the process and its child processes
+
+    """
+    os.environ[CONFIG_ENV] = path
+
+
+def config_path():
+    return os.environ.get(CONFIG_ENV) or DEFAULT_PATH
+
+
+def setup(config):
+    """Function for configuring logging and metrics from config, called on the first load
+
+    """
+    from src.ETL import Metrics
+    logging.basicConfig(
+        filename=config['logs_path'],
+        level=logging.INFO,
+        format='%(asctime)s :: %(name)s - %(levelname)s - %(message)s')
+    Metrics.configure(**(config.get('metrics') or {}))
+
+
+def load_config(path=None):
+    """Function for parsing config. Parsed config is cached until modification time of the file changes
+
+    Parameters
+    ----------
+    path : str
+        config path, ETL_CONFIG environment variable or default path if not specified
+
+    Returns
+    -------
+    dict
+        config with unresolved dynamic parameters
+
+    """
+    path = path or config_path()
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r') as file:
+            config = yaml.load(file, Loader=ConfigLoader)
+        first = not _cache
+        _cache[path] = (mtime, config)
+    if first:
+        setup(config)
+    return config
+
+
+def resolve(value):
+    """Function for building copy of config with evaluated dynamic parameters
+
+    """
+    if isinstance(value, Resolver):
+        return value()
+    if isinstance(value, dict):
+        return {key: resolve(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item) for item in value]
+    return value
+
+
+def get_config(path=None):
+    """Function for getting config of a run. Dynamic parameters are evaluated on every call
+
+    Parameters
+    ----------
+    path : str
+        config path, becomes config path of the process if specified
+
+    Returns
+    -------
+    dict
+        config
+
+    """
+    if path:
+        set_config_path(path)
+    return resolve(load_config())
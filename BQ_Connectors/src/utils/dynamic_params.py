@@ -7,6 +7,7 @@ Author: Anton Popkov
 """
 
 import pandas as pd
+from copy import deepcopy
 
 
 def create_date(dt_timedelta, dt_format, add=True):
@@ -38,3 +39,125 @@ def create_zd_query(str_template, sddt_timedelta, sddt_format, sdadd, fddt_timed
     finish_date = create_date(fddt_timedelta, fddt_format, fdadd)
     params = {'start_date': start_date, 'finish_date': finish_date}
     return str_template.format(**params)
+
+
+def set_param(params, path, value):
+    """Function for setting nested request parameter
+
+    Parameters
+    ----------
+    params : dict
+        request parameters
+    path : list
+        keys of nested parameter, e.g. ['json', 'section', 'customDate', 'from']
+    value : object
+        parameter value
+
+    """
+    for key in path[:-1]:
+        params = params[key]
+    params[path[-1]] = value
+
+
+def watermark_window(watermark_keys, watermark=None):
+    """Function for computing incremental request window. Window starts at the watermark minus overlap,
+    or initial_days before today if there is no watermark yet, and finishes to_days after today
+
+    Parameters
+    ----------
+    watermark_keys : dict
+        watermark section of pipeline config
+    watermark : str
+        max value of date column loaded by previous runs
+
+    Returns
+    -------
+    tuple
+        formatted start and finish dates
+
+    """
+    dt_format = watermark_keys.get('format', '%Y-%m-%d')
+    if watermark:
+        start = pd.Timestamp(watermark) - pd.Timedelta(hours=watermark_keys.get('overlap_hours', 0))
+        start_date = start.strftime(dt_format)
+    else:
+        start_date = create_date(watermark_keys.get('initial_days', 3), dt_format, False)
+    finish_date = create_date(watermark_keys.get('to_days', 1), dt_format, True)
+    return start_date, finish_date
+
+
+def apply_window(extract_keys, watermark_keys, start_date, finish_date):
+    """Function for setting request window. Dates are written into from_path and to_path parameters,
+    or query_template is formatted into query_path parameter (Zendesk search)
+
+    Parameters
+    ----------
+    extract_keys : dict
+        request parameters
+    watermark_keys : dict
+        watermark section of pipeline config with parameter paths
+    start_date : str
+        formatted start of window
+    finish_date : str
+        formatted finish of window
+
+    Returns
+    -------
+    dict
+        request parameters with the window
+
+    """
+    params = deepcopy(extract_keys)
+    if watermark_keys.get('query_template'):
+        query = watermark_keys['query_template'].format(start_date=start_date, finish_date=finish_date)
+        set_param(params, watermark_keys['query_path'], query)
+    else:
+        set_param(params, watermark_keys['from_path'], start_date)
+        set_param(params, watermark_keys['to_path'], finish_date)
+    return params
+
+
+def apply_watermark(extract_keys, watermark_keys, watermark=None):
+    """Function for replacing fixed request window with incremental one
+
+    Parameters
+    ----------
+    extract_keys : dict
+        request parameters
+    watermark_keys : dict
+        watermark section of pipeline config
+    watermark : str
+        max value of date column loaded by previous runs
+
+    Returns
+    -------
+    dict
+        request parameters with incremental window
+
+    """
+    start_date, finish_date = watermark_window(watermark_keys, watermark)
+    return apply_window(extract_keys, watermark_keys, start_date, finish_date)
+
+
+def date_windows(start_date, finish_date, days=1):
+    """Function for splitting date range into consecutive windows, finish of a window is the start of the next one
+
+    Parameters
+    ----------
+    start_date : str
+        start of range
+    finish_date : str
+        finish of range, not included
+    days : int
+        length of window in days
+
+    Returns
+    -------
+    list
+        pairs of window start and finish timestamps
+
+    """
+    bounds = list(pd.date_range(start_date, finish_date, freq=f'{days}D'))
+    if bounds[-1] < pd.Timestamp(finish_date):
+        bounds.append(pd.Timestamp(finish_date))
+    return list(zip(bounds[:-1], bounds[1:]))
@@ -1,55 +1,150 @@
-import requests
-from src.ETL.Loading import LoaderBQ
-from src.ETL.Extraction import GeneralRequest
-from src.ETL.Transformation import TransformationDask
-
-
-def pagination_getresponse(creds, key_ind):
-    extractor = GeneralRequest(request_func=requests.request, params=creds[key_ind]['extract_keys'])
-    response = extractor.run_requests()
-
-    transformer = TransformationDask(raw_data=response, creds=creds[key_ind]['transform_keys'])
-    transformed_data = transformer.run_transformation()
-
-    loader = LoaderBQ(creds=creds[key_ind]['load_keys'], data=transformed_data)
-    loader.execute_loading()
-
-    pages = int(response.headers['totalpages'])
-
-    if creds[key_ind]['extract_keys']['params']['page'] < pages:
-        creds[key_ind]['extract_keys']['params']['page'] += 1
-        return pagination_getresponse(creds=creds, key_ind=key_ind)
-
-
-def pagination_zendesk(creds, key_ind):
-    extractor = GeneralRequest(request_func=requests.request, params=creds[key_ind]['extract_keys'])
-    response = extractor.run_requests()
-
-    transformer = TransformationDask(raw_data=response, creds=creds[key_ind]['transform_keys'])
-    transformed_data = transformer.run_transformation()
-
-    loader = LoaderBQ(creds=creds[key_ind]['load_keys'], data=transformed_data)
-    loader.execute_loading()
-
-    next_page = response.json()['next_page']
-
-    if next_page:
-        creds[key_ind]['extract_keys']['url'] = next_page.split('&')[0]
-        return pagination_zendesk(creds=creds, key_ind=key_ind)
-
-
-def pagination_pushwoosh(creds, key_ind):
-    extractor = GeneralRequest(request_func=requests.request, params=creds[key_ind]['extract_keys'])
-    response = extractor.run_requests()
-
-    transformer = TransformationDask(raw_data=response, creds=creds[key_ind]['transform_keys'])
-    transformed_data = transformer.run_transformation()
-
-    loader = LoaderBQ(creds=creds[key_ind]['load_keys'], data=transformed_data)
-    loader.execute_loading()
-
-    pagination_token = response.json()['pagination_token']
-
-    if pagination_token:
-        creds[key_ind]['extract_keys']['json']['pagination_token'] = pagination_token
-        return pagination_pushwoosh(creds=creds, key_ind=key_ind)
+from copy import deepcopy
+from src.ETL import Metrics
+from src.ETL.Loading import LoaderBQ, BQSession
+from src.ETL.Extraction import GeneralRequest, shared_session
+from src.ETL.Transformation import TRANSFORMERS
+from src.ETL.Pipeline import PaginationPipeline
+from src.ETL.Spool import PageSpool
+from src.ETL.State import CheckpointStore, WatermarkStore
+from src.utils.dynamic_params import apply_watermark, apply_window
+from src.ETL.RateLimiting import shared_rate_limiter
+from src.ETL.Pagination import PageNumberPaginator, NextUrlPaginator, CursorTokenPaginator, create_paginator
+
+
+def create_pipeline(creds, key_ind, paginator=None, session=None, bq_session=None, spool=None, resume=False):
+    pagination_keys = creds[key_ind].get('pagination_keys') or {}
+    if paginator is None:
+        paginator = create_paginator(pagination_keys)
+    if session is None:
+        session = shared_session(**(creds.get('http_session') or {}))
+    if spool is None and creds[key_ind]['load_keys'].get('spool') == 'Y':
+        spool = PageSpool(key_ind=key_ind, **creds['spool'])
+    checkpoints = CheckpointStore(**creds['checkpoints']) if creds.get('checkpoints') else None
+    watermarks = None
+    watermark_keys = creds[key_ind].get('watermark_keys') or {}
+    if watermark_keys.get('incremental') == 'Y':
+        watermarks = WatermarkStore(**creds['watermarks'])
+        pipeline_creds = dict(creds[key_ind])
+        pipeline_creds['extract_keys'] = apply_watermark(pipeline_creds['extract_keys'], watermark_keys,
+                                                         watermarks.load(key_ind))
+        creds = {**creds, key_ind: pipeline_creds}
+    transformer = TRANSFORMERS[creds[key_ind]['transform_keys'].get('engine', 'dask')]
+    pipeline = PaginationPipeline(creds=creds[key_ind], paginator=paginator, request_func=session.request,
+                                  extractor=GeneralRequest, transformer=transformer, loader=LoaderBQ,
+                                  queue_size=pagination_keys.get('queue_size', 2),
+                                  concurrency=pagination_keys.get('concurrency', 1),
+                                  ordered=pagination_keys.get('ordered', True),
+                                  rate_limiter=shared_rate_limiter(**(creds.get('rate_limits') or {})),
+                                  stream=pagination_keys.get('stream', False),
+                                  chunk_size=pagination_keys.get('chunk_size', 5000),
+                                  loader_session=bq_session or BQSession(
+                                      max_in_flight=creds[key_ind]['load_keys'].get('max_in_flight', 4)),
+                                  spool=spool, checkpoints=checkpoints, name=key_ind, resume=resume,
+                                  watermarks=watermarks)
+    return pipeline
+
+
+def run_pagination(creds, key_ind, paginator=None, session=None, bq_session=None, resume=False):
+    if session is None:
+        session = shared_session(**(creds.get('http_session') or {}))
+    Metrics.set_pipeline(key_ind)
+    pipeline = create_pipeline(creds=creds, key_ind=key_ind, paginator=paginator, session=session,
+                               bq_session=bq_session, resume=resume)
+    result = pipeline.run()
+    session.log_stats()
+    return result
+
+
+def scale_rate_limits(rate_limits, workers):
+    """Function for splitting API rate limits between worker processes, so their sum stays within the limits
+
+    """
+    scaled = deepcopy(rate_limits or {})
+    for limits in [scaled, *(scaled.get('hosts') or {}).values()]:
+        for key in ('rate', 'capacity'):
+            if key in limits:
+                limits[key] = max(limits[key] / workers, 1 if key == 'capacity' else 0.1)
+    return scaled
+
+
+def check_backfill_deletes(load_keys):
+    """Function for checking that deletes of a backfill shard touch only its own table and window.
+    Delete templates have to name the table as {table}, deletes by date need delete_by_window template
+
+    Parameters
+    ----------
+    load_keys : dict
+        load_keys of pipeline from config.yaml
+
+    """
+    if load_keys.get('in_clause_del') == 'Y' and '{table}' not in load_keys.get('delete_by_condition', ''):
+        raise ValueError("Backfill with in_clause_del needs {table} in delete_by_condition")
+    if load_keys.get('by_date_del') == 'Y' and '{table}' not in load_keys.get('delete_by_window', ''):
+        raise ValueError("Backfill with by_date_del needs delete_by_window template with {table}")
+
+
+def backfill_shard(creds, key_ind, start_date, finish_date, sharding=True, workers=1, resume=False):
+    """Function for loading a window of historical data. Shard runs as a separate pipeline with its own
+    pagination chain, checkpoint and spool, and loads into a table sharded by window start.
+    Deletes by date of the shard are limited by the end of its window
+
+    Parameters
+    ----------
+    creds : dict
+        config.yaml
+    key_ind : str
+        pipeline name from config.yaml
+    start_date : Timestamp
+        start of window
+    finish_date : Timestamp
+        finish of window, not included
+    sharding : bool
+        flag for loading into <bq_table>_<YYYYMMDD> tables instead of the destination table
+    workers : int
+        number of shards running at the same time, rate limits are split between them
+    resume : bool
+        flag for continuing shard from its checkpoint
+
+    Returns
+    -------
+    dict
+        run statistics
+
+    """
+    check_backfill_deletes(creds[key_ind]['load_keys'])
+    watermark_keys = creds[key_ind]['watermark_keys']
+    dt_format = watermark_keys.get('format', '%Y-%m-%d')
+    shard_key = f"{key_ind}_{start_date:%Y%m%d}"
+    shard_creds = deepcopy(creds[key_ind])
+    shard_creds['extract_keys'] = apply_window(shard_creds['extract_keys'], watermark_keys,
+                                               start_date.strftime(dt_format), finish_date.strftime(dt_format))
+    shard_creds['watermark_keys'] = {**watermark_keys, 'incremental': 'N'}
+    shard_creds['load_keys']['window_end'] = f"{finish_date:%Y-%m-%d %H:%M:%S}"
+    if sharding:
+        shard_creds['load_keys']['sharding_date'] = f"{start_date:%Y%m%d}"
+    creds = {**creds, shard_key: shard_creds, 'rate_limits': scale_rate_limits(creds.get('rate_limits'), workers)}
+    result = run_pagination(creds=creds, key_ind=shard_key, resume=resume)
+    Metrics.finish_run(prometheus=False)
+    Metrics.reset()
+    return result
+
+
+def replay_spool(creds, key_ind, run_id=None, bq_session=None):
+    run_ids = [run_id] if run_id else PageSpool.runs(creds['spool']['path'], key_ind)
+    results = {}
+    for run in run_ids:
+        spool = PageSpool(key_ind=key_ind, run_id=run, **creds['spool'])
+        results[run] = create_pipeline(creds=creds, key_ind=key_ind, bq_session=bq_session, spool=spool).replay()
+    return results
+
+
+def pagination_getresponse(creds, key_ind, session=None, resume=False):
+    return run_pagination(creds=creds, key_ind=key_ind, paginator=PageNumberPaginator(), session=session, resume=resume)
+
+
+def pagination_zendesk(creds, key_ind, session=None, resume=False):
+    return run_pagination(creds=creds, key_ind=key_ind, paginator=NextUrlPaginator(), session=session, resume=resume)
+
+
+def pagination_pushwoosh(creds, key_ind, session=None, resume=False):
+    return run_pagination(creds=creds, key_ind=key_ind, paginator=CursorTokenPaginator(), session=session, resume=resume)
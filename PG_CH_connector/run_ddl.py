@@ -1,35 +1,51 @@
 #!/usr/bin/env python3
 """DDL pipeline
 
-Map types from PostgreSQL to Clickhouse, creates DDL query and executes it
+Map types from PostgreSQL to Clickhouse, creates DDL query and executes it,
+propagates changes of columns of existing tables
 
 Author: Anton Popkov
 
 """
 
+import argparse
 import psycopg2
-from clickhouse_driver import connect
-from src.ErrorDecorator import credentials
+from clickhouse_driver import Client
+from src import Metrics
+from src.config import get_config
 from src.ETL import Connector, TypesMapper
-
-
-pg_conn_dict = {
-    'func': psycopg2.connect,
-    'params': credentials['pg_params'],
-    'sql_query': credentials['pg_queries']['dbtables_query']
-}
-
-ch_conn_dict = {
-    'func': connect,
-    'params': credentials['ch_params'],
-    'sql_query': credentials['ch_queries']['dbtables_query']
-}
+from src.Drift import SchemaDrift
 
 
 def run_ddl():
+    parser = argparse.ArgumentParser(description='Create Clickhouse tables for PostgreSQL tables')
+    parser.add_argument('--config', default=None, help='path of config.yaml, PG_CH_CONFIG env if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+
+    pg_conn_dict = {
+        'func': psycopg2.connect,
+        'params': credentials['pg_params'],
+        'sql_query': credentials['pg_queries']['dbtables_query']
+    }
+
+    ch_conn_dict = {
+        'func': Client,
+        'params': credentials['ch_params'],
+        'sql_query': credentials['ch_queries']['dbtables_query']
+    }
+
+    Metrics.set_pipeline('ddl')
     integrator = TypesMapper(connector=Connector, creds=credentials, from_db_params=pg_conn_dict,
                              to_db_params=ch_conn_dict)
-    integrator.execute_full_mapping()
+    mapping = credentials.get('mapping') or {}
+    if mapping.get('mode') == 'bulk':
+        integrator.execute_bulk_mapping(workers=mapping.get('workers', 1))
+    else:
+        integrator.execute_full_mapping()
+    if (credentials.get('drift') or {}).get('enabled'):
+        SchemaDrift(mapper=integrator, creds=credentials).execute_drift()
+    Metrics.finish_run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Replication pipeline
+
+Copy PostgreSQL tables into MergeTree tables of Clickhouse
+
+Author: Anton Popkov
+
+"""
+
+import argparse
+import psycopg2
+from clickhouse_driver import Client
+from src import Metrics
+from src.config import get_config
+from src.ETL import Connector, TypesMapper
+from src.Replication import Replicator
+
+
+def run_replication():
+    parser = argparse.ArgumentParser(description='Copy PostgreSQL tables into MergeTree tables of Clickhouse')
+    parser.add_argument('--tables', nargs='+', default=None, help='table names, replication.tables if not specified')
+    parser.add_argument('--config', default=None, help='path of config.yaml, PG_CH_CONFIG env if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+
+    pg_conn_dict = {
+        'func': psycopg2.connect,
+        'params': credentials['pg_params'],
+        'sql_query': None
+    }
+
+    ch_conn_dict = {
+        'func': Client,
+        'params': credentials['ch_params'],
+        'sql_query': None
+    }
+
+    Metrics.set_pipeline('replication')
+    mapper = TypesMapper(connector=Connector, creds=credentials, from_db_params=pg_conn_dict,
+                         to_db_params=ch_conn_dict)
+    replicator = Replicator(mapper=mapper, creds=credentials, from_db_params=pg_conn_dict, to_db_params=ch_conn_dict)
+    replicator.execute_replication(args.tables)
+    Metrics.finish_run()
+
+
+if __name__ == '__main__':
+    run_replication()
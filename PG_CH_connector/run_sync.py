@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Sync pipeline
+
+Copy rows changed since the previous run from PostgreSQL tables into ReplacingMergeTree tables of Clickhouse
+
+Author: Anton Popkov
+
+"""
+
+import sys
+import argparse
+import psycopg2
+from clickhouse_driver import Client
+from src import Metrics
+from src.config import get_config
+from src.ETL import Connector, TypesMapper
+from src.Sync import IncrementalSync
+
+
+def run_sync():
+    parser = argparse.ArgumentParser(description='Sync changed rows of PostgreSQL tables into Clickhouse')
+    parser.add_argument('--tables', nargs='+', default=None, help='table names, sync.tables if not specified')
+    parser.add_argument('--reset', action='store_true', help='drop stored watermarks of tables before sync')
+    parser.add_argument('--config', default=None, help='path of config.yaml, PG_CH_CONFIG env if not specified')
+    args = parser.parse_args()
+    credentials = get_config(args.config)
+
+    pg_conn_dict = {
+        'func': psycopg2.connect,
+        'params': credentials['pg_params'],
+        'sql_query': None
+    }
+
+    ch_conn_dict = {
+        'func': Client,
+        'params': credentials['ch_params'],
+        'sql_query': None
+    }
+
+    Metrics.set_pipeline('sync')
+    mapper = TypesMapper(connector=Connector, creds=credentials, from_db_params=pg_conn_dict,
+                         to_db_params=ch_conn_dict)
+    sync = IncrementalSync(mapper=mapper, creds=credentials, from_db_params=pg_conn_dict, to_db_params=ch_conn_dict)
+    tables = args.tables or list(sync.settings.get('tables') or {})
+    if args.reset:
+        for name in tables:
+            sync.state.delete(name)
+    stats = sync.execute_sync(tables)
+    Metrics.finish_run()
+    if len(stats) < len(tables):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_sync()
@@ -0,0 +1,218 @@
+"""Classes for schema drift
+
+Detect changes of columns of PostgreSQL tables already mapped into Clickhouse and propagate them. Columns of
+all tables are read with a single catalog query and hashed per table, hashes are compared with the snapshot
+of the previous run stored in a local JSON file, only changed tables are queried and altered in Clickhouse
+
+Author: Anton Popkov
+
+"""
+
+import hashlib
+import logging
+from src.ErrorDecorator import ErrDecorator
+from src.ETL import sql_in_list
+from src.State import JSONStateStore
+
+SNAPSHOT_COLUMNS = ['column_name', 'data_type', 'is_nullable']
+
+
+class SchemaDrift(ErrDecorator):
+    """Class for propagating changes of PostgreSQL columns into Clickhouse tables. Tables of PostgreSQL engine
+    are recreated, tables of MergeTree family are altered: new columns are added, removed columns are dropped
+    and columns with changed type are modified. Changes of sorting key columns are not applied.
+    The first run records snapshot without changes
+
+    Parameters
+    ----------
+    mapper : TypesMapper class instance
+        provides connections and mapping of types
+    creds : dict
+        parameters from config.yaml
+
+    """
+
+    def __init__(self, mapper, creds):
+        super().__init__()
+        self.mapper = mapper
+        self.creds = creds
+        self.store = JSONStateStore((creds.get('drift') or {})['snapshot_path'])
+
+    @ErrDecorator.sys_error_decorator
+    def get_snapshot(self):
+        """Method for getting columns of all tables of source schema with a single catalog query
+
+        Returns
+        -------
+        pandas DataFrame
+            table_name, column_name, data_type and is_nullable in order of columns
+
+        """
+        params = {**self.mapper.from_db_params, 'sql_query': self.creds['pg_queries']['schema_snapshot_query']}
+        return self.mapper.create_connector(params).execute_pipeline()
+
+    @staticmethod
+    def hash_tables(columns_df):
+        """Method for hashing columns of every table
+
+        Returns
+        -------
+        dict
+            table name and hash of its columns
+
+        """
+        lines = columns_df['column_name'] + ' ' + columns_df['data_type'] + ' ' + columns_df['is_nullable']
+        bodies = lines.groupby(columns_df['table_name'], sort=False).agg('\n'.join)
+        return {name: hashlib.md5(body.encode()).hexdigest() for name, body in bodies.items()}
+
+    @ErrDecorator.sys_error_decorator
+    def get_engines(self, tables):
+        """Method for getting engines and sorting keys of Clickhouse tables
+
+        Returns
+        -------
+        dict
+            table name and tuple of engine and sorting key columns
+
+        """
+        query = self.creds['ch_queries']['tables_engine_query'].format(names=sql_in_list(sorted(tables)))
+        engines_df = self.mapper.create_connector({**self.mapper.to_db_params, 'sql_query': query}).execute_pipeline()
+        return {name: (engine, {key.strip() for key in sorting_key.split(',') if key.strip()})
+                for name, engine, sorting_key in engines_df[['name', 'engine', 'sorting_key']].values}
+
+    @staticmethod
+    def column_changes(old_columns, table_df):
+        """Method for comparing columns of a table with its snapshot
+
+        Parameters
+        ----------
+        old_columns : list
+            column_name, data_type and is_nullable of columns from snapshot
+        table_df : pandas DataFrame
+            current mapped columns of the table
+
+        Returns
+        -------
+        tuple
+            added, dropped and modified column names
+
+        """
+        old = {column: (data_type, nullable) for column, data_type, nullable in old_columns}
+        new = {column: (data_type, nullable) for column, data_type, nullable in table_df[SNAPSHOT_COLUMNS].values}
+        added = [column for column in new if column not in old]
+        dropped = [column for column in old if column not in new]
+        modified = [column for column in new if column in old and new[column] != old[column]]
+        return added, dropped, modified
+
+    @ErrDecorator.sys_error_decorator
+    def build_statements(self, name, engine, keys, old_columns, table_df, to_types_df):
+        """Method for building statements propagating changes of a table
+
+        Parameters
+        ----------
+        name : str
+            table name
+        engine : str
+            engine of Clickhouse table
+        keys : set
+            sorting key columns of Clickhouse table
+        old_columns : list
+            columns from snapshot
+        table_df : pandas DataFrame
+            current mapped columns of the table
+        to_types_df : pandas DataFrame
+            dataframe with desired data types
+
+        Returns
+        -------
+        list
+            statements, empty if there is nothing to change (e.g. columns are reordered),
+            None if changes can not be applied
+
+        """
+        ch_queries = self.creds['ch_queries']
+        if engine == 'PostgreSQL':
+            create = self.mapper.build_queries(table_df[['table_name', 'column_name', 'data_type']], to_types_df)
+            return [ch_queries['drop_table_query'].format(name=name), create[name]]
+        if not engine.endswith('MergeTree'):
+            logging.error(f"{name}: changes of {engine} engine tables are not supported")
+            return None
+        added, dropped, modified = self.column_changes(old_columns, table_df)
+        if keys & set(dropped + modified):
+            logging.error(f"{name}: sorting key columns {sorted(keys & set(dropped + modified))} changed, "
+                          f"table has to be replicated again")
+            return None
+        types = {column: f"Nullable({to_type})" if nullable == 'YES' else to_type
+                 for column, to_type, nullable in table_df[['column_name', 'to_data_type', 'is_nullable']].values}
+        return ([ch_queries['add_column_query'].format(name=name, column=column, type=types[column])
+                 for column in added] +
+                [ch_queries['modify_column_query'].format(name=name, column=column, type=types[column])
+                 for column in modified] +
+                [ch_queries['drop_column_query'].format(name=name, column=column) for column in dropped])
+
+    @ErrDecorator.pass_error_decorator
+    def apply_statements(self, name, statements):
+        """Method for executing statements of a table, errors are logged and passed, so the table
+        keeps its previous snapshot and is processed again on the next run
+
+        Returns
+        -------
+        bool
+            True if statements are executed
+
+        """
+        connector = self.mapper.create_connector({**self.mapper.to_db_params, 'sql_query': None})
+        connector.execute_statements(statements)
+        logging.info(f"{name}: {len(statements)} schema changes applied")
+        return True
+
+    @ErrDecorator.sys_error_decorator
+    def execute_drift(self):
+        """Method for detecting and propagating schema changes. Unchanged tables cost only the catalog query
+
+        Returns
+        -------
+        dict
+            names of changed tables and flags of applied changes
+
+        """
+        columns_df = self.get_snapshot()
+        hashes = self.hash_tables(columns_df)
+        with self.store.locked():
+            cached = self.store.read()
+        snapshot = {name: entry for name, entry in cached.items() if name in hashes}
+        removed = set(cached) - set(hashes)
+        if removed:
+            logging.info(f"Tables {sorted(removed)} removed from snapshot")
+        groups = dict(tuple(columns_df.groupby('table_name', sort=False)))
+        changed = [name for name in hashes if name in cached and cached[name]['hash'] != hashes[name]]
+        for name in hashes:
+            if name not in cached:
+                snapshot[name] = self.snapshot_entry(hashes[name], groups[name])
+        results = {}
+        if changed:
+            to_types_df = self.mapper.get_types()
+            mapped_df = self.mapper.map_columns(columns_df[columns_df['table_name'].isin(changed)], to_types_df)
+            mapped = dict(tuple(mapped_df.groupby('table_name', sort=False)))
+            engines = self.get_engines(changed)
+            for name in changed:
+                if name not in engines:
+                    snapshot[name] = self.snapshot_entry(hashes[name], groups[name])
+                    continue
+                statements = self.build_statements(name, *engines[name], cached[name]['columns'], mapped[name],
+                                                   to_types_df) if name in mapped else None
+                if statements == []:
+                    logging.info(f"{name}: columns are reordered or unchanged, no schema changes")
+                results[name] = statements is not None and (not statements or
+                                                            bool(self.apply_statements(name, statements)))
+                if results[name]:
+                    snapshot[name] = self.snapshot_entry(hashes[name], groups[name])
+        with self.store.locked():
+            self.store.write(snapshot)
+        logging.info(f"{len(hashes)} tables checked, {len(changed)} changed, "
+                     f"{sum(results.values())} updated in Clickhouse")
+        return results
+
+    @staticmethod
+    def snapshot_entry(table_hash, table_df):
+        return {'hash': table_hash, 'columns': table_df[SNAPSHOT_COLUMNS].values.tolist()}
@@ -6,34 +6,61 @@ Author: Anton Popkov
 
 """
 
+import logging
 import pandas as pd
+from uuid import uuid4
+from itertools import islice
 from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from src import Pool
 from src.ErrorDecorator import ErrDecorator
 
 
+def sql_in_list(values):
+    """Function for building sql IN list of string literals
+
+    Parameters
+    ----------
+    values : iterable
+        values to quote
+
+    Returns
+    -------
+    str
+        list in parentheses, e.g. ('a', 'b')
+
+    """
+    quoted = ["'" + str(value).replace("'", "''") + "'" for value in values]
+    return f"({', '.join(quoted)})"
+
+
 class Connector(ErrDecorator):
     """Class for connection to Database
 
     Parameters
     ----------
     func : connection driver function
-        driver that provides connection (psycopg2.connect/clickhouse_driver.connect/etc.)
+        driver that provides connection (psycopg2.connect/clickhouse_driver.Client/etc.)
     sql_query : str
         sql query to execute wit connection driver
     params: dict
         connection parameters to parse into driver
+    fetch_rows : int
+        number of rows fetched from server at a time by stream_query
 
     """
 
-    def __init__(self, func, sql_query, params):
+    def __init__(self, func, sql_query, params, fetch_rows=10000):
         super().__init__()
         self.func = func
         self.params = params
         self.sql_query = sql_query
+        self.fetch_rows = fetch_rows
 
     @ErrDecorator.sys_error_decorator
     def create_connection(self):
-        """Method for establishing a connection to Database
+        """Method for getting a connection to Database from the pool of connections with the same parameters
 
         Returns
         -------
@@ -41,9 +68,43 @@ class Connector(ErrDecorator):
             conn
 
         """
-        conn = self.func(**self.params)
+        conn = Pool.acquire(self.func, self.params)
         return conn
 
+    def release_connection(self, conn, discard=False):
+        """Method for returning a connection into the pool
+
+        Parameters
+        ----------
+        conn : connection object
+            connection got from create_connection
+        discard : bool
+            flag for closing connection instead of reuse, e.g. after an error
+
+        """
+        Pool.release(conn, discard)
+
+    @contextmanager
+    def connection(self):
+        """Method for using a pooled connection in with statement. Connection is discarded on error and when
+        a generator using it is closed early, since its result may be read only partially
+
+        """
+        conn = self.create_connection()
+        try:
+            yield conn
+        except BaseException:
+            self.release_connection(conn, discard=True)
+            raise
+        self.release_connection(conn)
+
+    @staticmethod
+    def is_client(conn):
+        """Method for checking if connection is clickhouse_driver.Client rather than DB-API connection
+
+        """
+        return hasattr(conn, 'execute_iter')
+
     @ErrDecorator.sys_error_decorator
     def execute_query(self, conn):
         """Method for executing sql query in Database
@@ -59,6 +120,9 @@ class Connector(ErrDecorator):
             data
 
         """
+        if self.is_client(conn):
+            rows, columns = conn.execute(self.sql_query, with_column_types=True)
+            return pd.DataFrame.from_records(rows, columns=[column[0] for column in columns])
         data = pd.read_sql(sql=self.sql_query, con=conn)
         return data
 
@@ -72,10 +136,123 @@ class Connector(ErrDecorator):
             data
 
         """
-        conn = self.create_connection()
-        data = self.execute_query(conn)
+        with self.connection() as conn:
+            data = self.execute_query(conn)
         return data
 
+    @ErrDecorator.sys_error_decorator
+    def create_stream_cursor(self, conn):
+        """Method for creating a cursor keeping result on the server side. PostgreSQL gets a named cursor,
+        drivers supporting streaming of results (clickhouse_driver) get it switched on
+
+        Parameters
+        ----------
+        conn : connection object
+            established connection
+
+        Returns
+        -------
+        cursor object
+            cursor
+
+        """
+        if conn.__class__.__module__.startswith('psycopg2'):
+            cursor = conn.cursor(name=f"stream_{uuid4().hex}")
+            cursor.itersize = self.fetch_rows
+            return cursor
+        cursor = conn.cursor()
+        if hasattr(cursor, 'set_stream_results'):
+            cursor.set_stream_results(True, self.fetch_rows)
+        return cursor
+
+    def stream_rows(self, conn):
+        """Method for executing sql query and reading result by blocks of fetch_rows rows
+
+        Yields
+        ------
+        tuple
+            list of rows, column names
+
+        """
+        if self.is_client(conn):
+            rows = conn.execute_iter(self.sql_query, with_column_types=True,
+                                     settings={'max_block_size': self.fetch_rows})
+            names = [column[0] for column in next(rows)]
+            while True:
+                block = list(islice(rows, self.fetch_rows))
+                if not block:
+                    break
+                yield block, names
+            return
+        cursor = self.create_stream_cursor(conn)
+        cursor.execute(self.sql_query)
+        while True:
+            block = cursor.fetchmany(self.fetch_rows)
+            if not block:
+                break
+            yield block, [column[0] for column in cursor.description]
+        cursor.close()
+
+    def stream_query(self, output='pandas'):
+        """Method for executing sql query and reading result by chunks of fetch_rows rows, so memory use
+        does not depend on size of the result. Connection is returned into the pool when the result
+        is exhausted and discarded on error or when the generator is closed early, e.g. with contextlib.closing
+
+        Parameters
+        ----------
+        output : str
+            type of chunks: 'pandas', 'arrow' or 'rows'
+
+        Yields
+        ------
+        pandas DataFrame, pyarrow Table or list of tuples
+            chunk
+
+        """
+        try:
+            with self.connection() as conn:
+                for rows, names in self.stream_rows(conn):
+                    yield self.to_chunk(rows, names, output)
+        except Exception as error:
+            logging.error(f'Unexpected error in stream_query {error!r}')
+            raise
+
+    @staticmethod
+    def to_chunk(rows, names, output):
+        if output == 'rows':
+            return rows
+        if output == 'arrow':
+            import pyarrow as pa
+            return pa.table({name: list(column) for name, column in zip(names, zip(*rows))})
+        return pd.DataFrame.from_records(rows, columns=names)
+
+    @ErrDecorator.sys_error_decorator
+    def execute_statements(self, statements):
+        """Method for executing statements without result (DDL) over a single connection
+
+        Parameters
+        ----------
+        statements : list
+            sql statements
+
+        Returns
+        -------
+        int
+            number of executed statements
+
+        """
+        with self.connection() as conn:
+            if self.is_client(conn):
+                for statement in statements:
+                    conn.execute(statement)
+            else:
+                cursor = conn.cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.close()
+                conn.commit()
+        return len(statements)
+
 
 class TypesMapper(ErrDecorator):
     """Class for connection to Database
@@ -192,3 +369,122 @@ class TypesMapper(ErrDecorator):
         to_types_df = self.get_types()
         args = partial(self.execute_mapping, to_types_df=to_types_df)
         _ = [*map(args, tables_diff)]
+
+    @ErrDecorator.sys_error_decorator
+    def get_columns(self, tables):
+        """Method for getting columns of all tables with a single catalog query
+
+        Parameters
+        ----------
+        tables : set
+            table names
+
+        Returns
+        -------
+        pandas DataFrame
+            table_name, column_name and data_type in order of columns
+
+        """
+        query = self.creds['pg_queries']['tables_schema_query'].format(names=sql_in_list(sorted(tables)))
+        params = {**self.from_db_params, 'sql_query': query}
+        return self.create_connector(params).execute_pipeline()
+
+    @ErrDecorator.sys_error_decorator
+    def map_columns(self, columns_df, to_types_df):
+        """Method for mapping types of columns of all tables in one pass. Tables with types missing
+        in types_mappings are skipped
+
+        Parameters
+        ----------
+        columns_df : pandas DataFrame
+            columns of source tables
+        to_types_df : pandas DataFrame
+            dataframe with desired data types
+
+        Returns
+        -------
+        pandas DataFrame
+            columns of source tables with to_data_type column
+
+        """
+        converted_df = columns_df.merge(to_types_df, left_on='data_type', right_on='index', how='left', sort=False)
+        unmapped = converted_df['to_data_type'].isna()
+        if unmapped.any():
+            skipped = converted_df.loc[unmapped, 'table_name'].unique()
+            logging.error(f"Types {sorted(converted_df.loc[unmapped, 'data_type'].unique())} are not mapped, "
+                          f"tables {sorted(skipped)} skipped")
+            converted_df = converted_df[~converted_df['table_name'].isin(skipped)]
+        return converted_df
+
+    @ErrDecorator.sys_error_decorator
+    def build_queries(self, columns_df, to_types_df):
+        """Method for building DDL queries of all tables in one pass. Tables with types missing
+        in types_mappings are skipped
+
+        Parameters
+        ----------
+        columns_df : pandas DataFrame
+            columns of source tables
+        to_types_df : pandas DataFrame
+            dataframe with desired data types
+
+        Returns
+        -------
+        dict
+            table name and DDL query
+
+        """
+        converted_df = self.map_columns(columns_df, to_types_df)
+        columns = converted_df['column_name'] + ' ' + converted_df['to_data_type']
+        bodies = columns.groupby(converted_df['table_name'], sort=False).agg(',\n'.join)
+        template = self.creds['ch_queries']['create_table_query']
+        return {name: template.format(name=name, body=body) for name, body in bodies.items()}
+
+    @ErrDecorator.sys_error_decorator
+    def execute_queries(self, queries, workers=1):
+        """Method for executing DDL queries. Queries are split between workers, every worker runs its part
+        over its own connection
+
+        Parameters
+        ----------
+        queries : list
+            DDL queries
+        workers : int
+            number of parallel connections to target DB
+
+        Returns
+        -------
+        int
+            number of executed queries
+
+        """
+        workers = max(min(workers, len(queries)), 1)
+        parts = [queries[i::workers] for i in range(workers)]
+        connector = self.create_connector({**self.to_db_params, 'sql_query': None})
+        if workers == 1:
+            return connector.execute_statements(parts[0])
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(connector.execute_statements, parts))
+
+    @ErrDecorator.sys_error_decorator
+    def execute_bulk_mapping(self, workers=1):
+        """Method for mapping types for all tables in difference set with a single catalog query
+        and a single pass of DDL generation
+
+        Parameters
+        ----------
+        workers : int
+            number of parallel connections to target DB
+
+        Returns
+        -------
+        None
+
+        """
+        tables_diff = self.get_unmapped_tables()
+        if not tables_diff:
+            logging.info("No new tables to map")
+            return
+        queries = self.build_queries(self.get_columns(tables_diff), self.get_types())
+        executed = self.execute_queries(list(queries.values()), workers)
+        logging.info(f"{executed} tables created of {len(tables_diff)} new tables")
@@ -1,15 +1,17 @@
 import sys
-import yaml
 import logging
+from time import perf_counter
+from src import Metrics
+from src.config import get_config
 
-with open('/<path>/config.yaml', 'r') as file:
-    credentials = yaml.safe_load(file)
 
-logging.basicConfig(
-    filename=credentials['logs_path'],
-    level=logging.INFO,
-    # filemode = 'w',
-    format='%(asctime)s :: %(name)s - %(levelname)s - %(message)s')
+def __getattr__(name):
+    """Function for lazy loading of config on `from src.ErrorDecorator import credentials`
+
+    """
+    if name == 'credentials':
+        return get_config()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
 
 class ErrDecorator(object):
@@ -20,15 +22,22 @@ class ErrDecorator(object):
     def sys_error_decorator(func):
         """Method for decorating inner class methods with try-except block.
         Tries to execute the function, raises error if fails.
+        Records wall time, rows and bytes of the call if metrics are enabled.
 
         """
 
         def wrapper(self, *args, **kwargs):
+            start = perf_counter() if Metrics.ENABLED else None
             try:
-                return func(self, *args, **kwargs)
+                result = func(self, *args, **kwargs)
             except:
                 logging.error(f'Unexpected error in {func.__name__} {sys.exc_info()}')
+                if start is not None:
+                    Metrics.record(func.__qualname__, perf_counter() - start, error=True)
                 raise
+            if start is not None:
+                Metrics.record(func.__qualname__, perf_counter() - start, result)
+            return result
 
         return wrapper
 
@@ -0,0 +1,169 @@
+"""Run metrics
+
+Wall time, calls, rows and bytes of decorated methods aggregated per pipeline, with per-run report and
+export into Prometheus textfile or JSON lines. Recording is switched off by default, decorator then only
+checks a single flag
+
+Author: Anton Popkov
+
+"""
+
+import os
+import json
+import logging
+import threading
+from time import time
+
+ENABLED = os.environ.get('ETL_METRICS') == '1'
+SETTINGS = {'prometheus_path': '', 'jsonl_path': ''}
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+
+
+def configure(enabled=False, prometheus_path='', jsonl_path=''):
+    """Function for switching recording on and setting export paths. ETL_METRICS=1 environment variable
+    switches recording on regardless of config
+
+    """
+    global ENABLED
+    ENABLED = bool(enabled) or os.environ.get('ETL_METRICS') == '1'
+    SETTINGS.update(prometheus_path=prometheus_path, jsonl_path=jsonl_path)
+
+
+def set_pipeline(name):
+    """Function for attributing methods called from the current thread to a pipeline
+
+    """
+    _local.pipeline = name
+
+
+def get_pipeline():
+    return getattr(_local, 'pipeline', '')
+
+
+def bind_pipeline(func):
+    """Function for passing pipeline of the current thread to a function running in a worker thread
+
+    """
+    pipeline = get_pipeline()
+
+    def wrapper(*args, **kwargs):
+        set_pipeline(pipeline)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def measure(result):
+    """Function for getting number of rows and bytes of a method result without materializing it.
+    Database cursors are not measured
+
+    Returns
+    -------
+    tuple
+        rows, bytes
+
+    """
+    if hasattr(result, 'num_rows') and hasattr(result, 'nbytes'):
+        return result.num_rows, result.nbytes
+    if hasattr(result, 'memory_usage') and not hasattr(result, 'npartitions'):
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, list) and result and isinstance(result[0], (dict, list)):
+        return len(result), 0
+    return 0, 0
+
+
+def record(method, seconds, result=None, error=False):
+    """Function for adding a call of decorated method to statistics of the current pipeline
+
+    """
+    rows, nbytes = measure(result) if result is not None else (0, 0)
+    key = (get_pipeline(), method)
+    with _lock:
+        stats = _stats.setdefault(key, [0, 0.0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += rows
+        stats[3] += nbytes
+        stats[4] += error
+
+
+def report(pipeline=None):
+    """Function for building report of recorded methods. Time of a method includes decorated methods it calls
+
+    Parameters
+    ----------
+    pipeline : str
+        pipeline to report, all pipelines if not specified
+
+    Returns
+    -------
+    list
+        method statistics from the slowest to the fastest
+
+    """
+    with _lock:
+        items = list(_stats.items())
+    rows = [{'pipeline': key[0], 'method': key[1], 'calls': stats[0], 'seconds': round(stats[1], 4),
+             'rows': stats[2], 'bytes': stats[3], 'errors': stats[4]}
+            for key, stats in items if pipeline is None or key[0] == pipeline]
+    return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+
+def log_report(pipeline=None):
+    for row in report(pipeline):
+        logging.info(f"{row['pipeline'] or '-'} {row['method']}: {row['calls']} calls, {row['seconds']} s, "
+                     f"{row['rows']} rows, {row['bytes']} bytes, {row['errors']} errors")
+
+
+def export_prometheus(path):
+    """Function for writing report into Prometheus textfile collector format. File is replaced atomically
+
+    """
+    lines = []
+    for metric, field, kind in (('etl_method_calls_total', 'calls', 'counter'),
+                                ('etl_method_seconds_total', 'seconds', 'counter'),
+                                ('etl_method_rows_total', 'rows', 'counter'),
+                                ('etl_method_bytes_total', 'bytes', 'counter'),
+                                ('etl_method_errors_total', 'errors', 'counter')):
+        lines.append(f"# TYPE {metric} {kind}")
+        for row in report():
+            lines.append(f'{metric}{{pipeline="{row["pipeline"]}",method="{row["method"]}"}} {row[field]}')
+    with open(f"{path}.tmp", 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(f"{path}.tmp", path)
+
+
+def export_jsonl(path):
+    """Function for appending report of the run into JSON lines file, one line per method
+
+    """
+    finished = time()
+    with open(path, 'a') as file:
+        for row in report():
+            file.write(json.dumps({'finished': finished, 'pid': os.getpid(), **row}) + '\n')
+
+
+def finish_run(prometheus=True):
+    """Function for logging report of the run and exporting it into configured files
+
+    Parameters
+    ----------
+    prometheus : bool
+        flag for writing Prometheus textfile, disabled in worker processes sharing the file
+
+    """
+    if not ENABLED:
+        return
+    log_report()
+    if prometheus and SETTINGS['prometheus_path']:
+        export_prometheus(SETTINGS['prometheus_path'])
+    if SETTINGS['jsonl_path']:
+        export_jsonl(SETTINGS['jsonl_path'])
+
+
+def reset():
+    with _lock:
+        _stats.clear()
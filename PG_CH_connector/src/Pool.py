@@ -0,0 +1,270 @@
+"""Connection pool
+
+Connections shared by all Connector instances of a process. Pools are keyed by driver function and connection
+parameters, a connection is checked before it is handed out and reset when it is returned
+
+Author: Anton Popkov
+
+"""
+
+import json
+import atexit
+import logging
+import threading
+from time import monotonic
+from src.ErrorDecorator import ErrDecorator
+
+SETTINGS = {'enabled': True, 'min_size': 0, 'max_size': 10, 'timeout': 300, 'check_seconds': 30,
+            'idle_seconds': 600}
+
+_pools = {}
+_owners = {}
+_lock = threading.Lock()
+
+
+def configure(**settings):
+    """Function for setting pool parameters, applied to pools created afterwards
+
+    """
+    SETTINGS.update(settings)
+
+
+def close_connection(conn):
+    try:
+        if hasattr(conn, 'disconnect'):
+            conn.disconnect()
+        else:
+            conn.close()
+    except Exception:
+        logging.warning(f"Connection {conn!r} is not closed properly")
+
+
+def is_open(conn):
+    """Function for checking state of connection without a round trip
+
+    """
+    if getattr(conn, 'closed', 0) or getattr(conn, 'is_closed', False):
+        return False
+    return True
+
+
+def ping(conn):
+    """Function for checking connection with a round trip
+
+    """
+    if hasattr(conn, 'execute_iter'):
+        conn.execute('select 1')
+        return
+    cursor = conn.cursor()
+    cursor.execute('select 1')
+    cursor.fetchall()
+    cursor.close()
+    if hasattr(conn, 'rollback'):
+        conn.rollback()
+
+
+def reset(conn):
+    """Function for resetting connection before it returns to pool. Open transaction of PostgreSQL
+    connection is rolled back, so named cursors are closed and pgbouncer can release server connection
+
+    """
+    if conn.__class__.__module__.startswith('psycopg2') and not conn.autocommit:
+        conn.rollback()
+
+
+class ConnectionPool(ErrDecorator):
+    """Class for pool of connections with the same parameters
+
+    Parameters
+    ----------
+    func : connection driver function
+        driver that provides connection (psycopg2.connect/clickhouse_driver.Client/etc.)
+    params : dict
+        connection parameters to parse into driver
+    min_size : int
+        number of connections kept open
+    max_size : int
+        max number of connections, acquire waits for a released connection when reached
+    timeout : float
+        seconds to wait for a released connection
+    check_seconds : float
+        idle seconds after which connection is pinged before it is handed out
+    idle_seconds : float
+        idle seconds after which connections above min_size are closed
+
+    """
+
+    def __init__(self, func, params, min_size=0, max_size=10, timeout=300, check_seconds=30, idle_seconds=600):
+        super().__init__()
+        self.func = func
+        self.params = params
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.check_seconds = check_seconds
+        self.idle_seconds = idle_seconds
+        self.idle = []
+        self.size = 0
+        self.condition = threading.Condition()
+        for _ in range(min_size):
+            self.idle.append((self.connect(), monotonic()))
+            self.size += 1
+
+    def connect(self):
+        conn = self.func(**self.params)
+        with _lock:
+            _owners[id(conn)] = self
+        return conn
+
+    def discard(self, conn):
+        with _lock:
+            _owners.pop(id(conn), None)
+        close_connection(conn)
+
+    def healthy(self, conn, released):
+        if not is_open(conn):
+            return False
+        if monotonic() - released < self.check_seconds:
+            return True
+        try:
+            ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def shrink(self):
+        """Method for closing connections idle longer than idle_seconds above min_size, called under condition
+
+        """
+        now = monotonic()
+        while self.size > self.min_size and self.idle and now - self.idle[0][1] > self.idle_seconds:
+            conn, _ = self.idle.pop(0)
+            self.size -= 1
+            self.discard(conn)
+
+    @ErrDecorator.sys_error_decorator
+    def acquire(self):
+        """Method for getting a connection. Idle connections are reused from the most recent one,
+        a new connection is created while pool is below max_size
+
+        Returns
+        -------
+        connection object
+            conn
+
+        """
+        deadline = monotonic() + self.timeout
+        while True:
+            with self.condition:
+                self.shrink()
+                if self.idle:
+                    conn, released = self.idle.pop()
+                elif self.size < self.max_size:
+                    self.size += 1
+                    conn, released = None, None
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No free connection in pool of {self.max_size} connections")
+                    self.condition.wait(remaining)
+                    continue
+            if conn is None:
+                try:
+                    return self.connect()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+            if self.healthy(conn, released):
+                return conn
+            logging.warning("Broken connection removed from pool")
+            with self.condition:
+                self.size -= 1
+            self.discard(conn)
+
+    def release(self, conn, discard=False):
+        """Method for returning a connection into pool
+
+        Parameters
+        ----------
+        conn : connection object
+            acquired connection
+        discard : bool
+            flag for closing connection instead of reuse, e.g. after an error
+
+        """
+        if not discard:
+            try:
+                reset(conn)
+            except Exception:
+                discard = True
+        with self.condition:
+            if discard or not is_open(conn):
+                self.size -= 1
+            else:
+                self.idle.append((conn, monotonic()))
+            self.condition.notify()
+        if discard or not is_open(conn):
+            self.discard(conn)
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for conn, _ in idle:
+            self.discard(conn)
+
+
+def get_pool(func, params):
+    """Function for getting pool of connections with given driver and parameters, pool is created on first use
+
+    Returns
+    -------
+    ConnectionPool
+        pool
+
+    """
+    key = (func, json.dumps(params, sort_keys=True, default=str))
+    with _lock:
+        pool = _pools.get(key)
+    if pool is None:
+        settings = {name: value for name, value in SETTINGS.items() if name != 'enabled'}
+        created = ConnectionPool(func, params, **settings)
+        with _lock:
+            pool = _pools.setdefault(key, created)
+        if pool is not created:
+            created.close()
+    return pool
+
+
+def acquire(func, params):
+    """Function for getting a connection, a new unpooled connection if pooling is disabled
+
+    """
+    if not SETTINGS['enabled']:
+        return func(**params)
+    return get_pool(func, params).acquire()
+
+
+def release(conn, discard=False):
+    """Function for returning a connection into its pool, connections out of pools are closed
+
+    """
+    with _lock:
+        pool = _owners.get(id(conn))
+    if pool is None:
+        close_connection(conn)
+    else:
+        pool.release(conn, discard)
+
+
+def close_all():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_all)
@@ -0,0 +1,318 @@
+"""Classes for replication of data
+
+Copy PostgreSQL tables into native MergeTree tables of Clickhouse. Rows are streamed from PostgreSQL with
+server-side cursors and inserted into Clickhouse in columnar blocks over native protocol, a table can be
+split by ranges of a numeric column between parallel workers
+
+Author: Anton Popkov
+
+"""
+
+import logging
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from src.ErrorDecorator import ErrDecorator
+
+CONVERTERS = {'numeric': float, 'bytea': bytes}
+
+
+def split_ranges(low, high, parts):
+    """Function for splitting range of a numeric column into where clauses of equal width
+
+    Parameters
+    ----------
+    low : number
+        minimal value of the column
+    high : number
+        maximal value of the column
+    parts : int
+        number of ranges
+
+    Returns
+    -------
+    list
+        bounds of ranges, (None, None) for a whole table
+
+    """
+    if low is None or high is None or parts <= 1 or low == high:
+        return [(None, None)]
+    step = (high - low) / parts
+    bounds = [low + step * i for i in range(1, parts)]
+    if isinstance(low, int) and isinstance(high, int):
+        bounds = sorted(set(int(bound) for bound in bounds) - {low})
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def where_clause(column, low, high):
+    """Function for building where clause of a range. Range includes low bound, first range includes nulls
+
+    """
+    if low is None and high is None:
+        return ''
+    if low is None:
+        return f"where ({column} < {high} or {column} is null)"
+    if high is None:
+        return f"where {column} >= {low}"
+    return f"where {column} >= {low} and {column} < {high}"
+
+
+class Replicator(ErrDecorator):
+    """Class for replication of PostgreSQL tables into MergeTree tables of Clickhouse
+
+    Parameters
+    ----------
+    mapper : TypesMapper class instance
+        provides catalog of source tables and mapping of types
+    creds : dict
+        parameters from config.yaml
+    from_db_params: dict
+        parameters for Connector to establish connection to source DB
+    to_db_params: dict
+        parameters for Connector to establish connection to target DB, func is clickhouse_driver.Client
+
+    """
+
+    def __init__(self, mapper, creds, from_db_params, to_db_params):
+        super().__init__()
+        self.mapper = mapper
+        self.creds = creds
+        self.from_db_params = from_db_params
+        self.to_db_params = to_db_params
+        self.settings = creds.get('replication') or {}
+
+    def table_settings(self, name):
+        """Method for getting replication settings of a table, defaults are taken from replication section
+
+        """
+        tables = self.settings.get('tables') or {}
+        return {'workers': self.settings.get('workers', 1), 'block_rows': self.settings.get('block_rows', 100000),
+                'order_by': None, 'split_col': None, **(tables.get(name) or {})}
+
+    def ch_client(self):
+        """Method for using a pooled Clickhouse client in with statement
+
+        """
+        return self.mapper.create_connector({**self.to_db_params, 'sql_query': None}).connection()
+
+    def pg_connection(self):
+        """Method for using a pooled PostgreSQL connection in with statement
+
+        """
+        return self.mapper.create_connector({**self.from_db_params, 'sql_query': None}).connection()
+
+    @ErrDecorator.sys_error_decorator
+    def get_schemas(self, tables):
+        """Method for getting mapped columns of tables with a single catalog query
+
+        Parameters
+        ----------
+        tables : iterable
+            table names
+
+        Returns
+        -------
+        dict
+            table name and pandas DataFrame of its columns
+
+        """
+        columns_df = self.mapper.map_columns(self.mapper.get_columns(set(tables)), self.mapper.get_types())
+        return {name: table_df for name, table_df in columns_df.groupby('table_name', sort=False)}
+
+    @ErrDecorator.sys_error_decorator
+    def build_ddl(self, name, columns_df, query='create_merge_tree_query', not_null=(), **params):
+        """Method for building DDL query of MergeTree family table. Nullable columns become Nullable types
+        except columns of sorting key
+
+        Parameters
+        ----------
+        name : str
+            Clickhouse table name
+        columns_df : pandas DataFrame
+            mapped columns of source table
+        query : str
+            name of DDL query template in ch_queries
+        not_null : iterable
+            columns kept not nullable in addition to sorting key, e.g. version column
+        params : dict
+            additional parameters of DDL query template
+
+        Returns
+        -------
+        str
+            DDL query
+
+        """
+        order_by = self.table_settings(columns_df['table_name'].iat[0])['order_by']
+        keys = {key.strip() for key in order_by.split(',')} if order_by else set()
+        keys.update(not_null)
+        types = [f"Nullable({to_type})" if nullable == 'YES' and column not in keys else to_type
+                 for column, to_type, nullable in columns_df[['column_name', 'to_data_type', 'is_nullable']].values]
+        body = ',\n'.join(f"{column} {to_type}" for column, to_type in zip(columns_df['column_name'], types))
+        return self.creds['ch_queries'][query].format(name=name, body=body, order_by=order_by or 'tuple()', **params)
+
+    @ErrDecorator.sys_error_decorator
+    def fetch_one(self, query):
+        """Method for getting the first row of PostgreSQL query result
+
+        Returns
+        -------
+        tuple
+            row
+
+        """
+        with self.pg_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            row = cursor.fetchone()
+            cursor.close()
+        return row
+
+    @ErrDecorator.sys_error_decorator
+    def get_ranges(self, name, split_col, workers):
+        """Method for splitting table between workers by ranges of split column
+
+        Returns
+        -------
+        list
+            where clauses of ranges
+
+        """
+        if not split_col or workers <= 1:
+            return ['']
+        low, high = self.fetch_one(self.creds['pg_queries']['range_query'].format(name=name, column=split_col))
+        return [where_clause(split_col, *bounds) for bounds in split_ranges(low, high, workers)]
+
+    @ErrDecorator.sys_error_decorator
+    def insert_blocks(self, select, target, columns_df, block_rows, on_block=None):
+        """Method for streaming result of a query into Clickhouse. Rows are fetched by Connector.stream_query
+        in blocks and inserted into Clickhouse in columnar form
+
+        Parameters
+        ----------
+        select : str
+            PostgreSQL query, its columns correspond to columns_df
+        target : str
+            Clickhouse table name
+        columns_df : pandas DataFrame
+            mapped columns of the query result
+        block_rows : int
+            number of rows in a block
+        on_block : function
+            called with every block after it is inserted
+
+        Returns
+        -------
+        int
+            number of copied rows
+
+        """
+        columns = list(columns_df['column_name'])
+        converters = [(i, CONVERTERS[data_type]) for i, data_type in enumerate(columns_df['data_type'])
+                      if data_type in CONVERTERS]
+        insert = self.creds['ch_queries']['insert_query'].format(name=target, columns=', '.join(columns))
+        connector = self.mapper.create_connector({**self.from_db_params, 'sql_query': select,
+                                                  'fetch_rows': block_rows})
+        blocks = connector.stream_query(output='rows')
+        rows = 0
+        try:
+            with self.ch_client() as client:
+                for block in blocks:
+                    data = [list(column) for column in zip(*block)]
+                    for i, func in converters:
+                        data[i] = [None if value is None else func(value) for value in data[i]]
+                    client.execute(insert, data, columnar=True)
+                    rows += len(block)
+                    if on_block:
+                        on_block(block)
+        finally:
+            blocks.close()
+        return rows
+
+    @ErrDecorator.sys_error_decorator
+    def copy_range(self, name, target, columns_df, where, block_rows):
+        """Method for copying range of a table
+
+        Parameters
+        ----------
+        name : str
+            source table name
+        target : str
+            Clickhouse table name
+        columns_df : pandas DataFrame
+            mapped columns of source table
+        where : str
+            where clause of the range
+        block_rows : int
+            number of rows in a block
+
+        Returns
+        -------
+        int
+            number of copied rows
+
+        """
+        columns = ', '.join(columns_df['column_name'])
+        select = self.creds['pg_queries']['select_query'].format(name=name, columns=columns, where=where)
+        return self.insert_blocks(select, target, columns_df, block_rows)
+
+    @ErrDecorator.sys_error_decorator
+    def replicate_table(self, name, columns_df):
+        """Method for replicating a table. Data is loaded into a new table which then replaces
+        the existing one, so readers never see a partially loaded table
+
+        Parameters
+        ----------
+        name : str
+            table name
+        columns_df : pandas DataFrame
+            mapped columns of source table
+
+        Returns
+        -------
+        int
+            number of copied rows
+
+        """
+        settings = self.table_settings(name)
+        ch_queries = self.creds['ch_queries']
+        new_name = f"{name}_new"
+        start = perf_counter()
+        with self.ch_client() as client:
+            client.execute(ch_queries['drop_table_query'].format(name=new_name))
+            client.execute(self.build_ddl(new_name, columns_df))
+        ranges = self.get_ranges(name, settings['split_col'], settings['workers'])
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            rows = sum(executor.map(lambda where: self.copy_range(name, new_name, columns_df, where,
+                                                                  settings['block_rows']), ranges))
+        with self.ch_client() as client:
+            if client.execute(ch_queries['exists_table_query'].format(name=name))[0][0]:
+                client.execute(ch_queries['exchange_tables_query'].format(name=name, new_name=new_name))
+                client.execute(ch_queries['drop_table_query'].format(name=new_name))
+            else:
+                client.execute(ch_queries['rename_table_query'].format(name=new_name, new_name=name))
+        seconds = perf_counter() - start
+        logging.info(f"{name}: {rows} rows replicated by {len(ranges)} workers in {seconds:.1f} s, "
+                     f"{rows / seconds:.0f} rows/sec")
+        return rows
+
+    @ErrDecorator.sys_error_decorator
+    def execute_replication(self, tables=None):
+        """Method for replicating tables one by one
+
+        Parameters
+        ----------
+        tables : list
+            table names, tables of replication section if not specified
+
+        Returns
+        -------
+        dict
+            table name and number of copied rows
+
+        """
+        tables = tables or list(self.settings.get('tables') or {})
+        schemas = self.get_schemas(tables)
+        missing = set(tables) - set(schemas)
+        if missing:
+            logging.error(f"Tables {sorted(missing)} are not found or not mapped, skipped")
+        return {name: self.replicate_table(name, schemas[name]) for name in tables if name in schemas}
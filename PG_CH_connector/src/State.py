@@ -0,0 +1,81 @@
+"""State
+
+Local JSON store of state persisted between runs
+
+Author: Anton Popkov
+
+"""
+
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from src.ErrorDecorator import ErrDecorator
+
+
+class JSONStateStore(ErrDecorator):
+    """Class for storing state in a local JSON file. Writes are atomic and serialized between
+    threads and processes with a lock file
+
+    Parameters
+    ----------
+
+    path : str
+        path of JSON file
+
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self.lock, open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self):
+        """Method for reading the whole state
+
+        Returns
+        -------
+        dict
+            state
+
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as file:
+            return json.load(file)
+
+    def write(self, state):
+        with open(f"{self.path}.tmp", 'w') as file:
+            json.dump(state, file, indent=2, default=str)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    @ErrDecorator.sys_error_decorator
+    def get(self, key, default=None):
+        with self.locked():
+            return self.read().get(key, default)
+
+    @ErrDecorator.sys_error_decorator
+    def set(self, key, value):
+        with self.locked():
+            state = self.read()
+            state[key] = value
+            self.write(state)
+
+    @ErrDecorator.sys_error_decorator
+    def delete(self, key):
+        with self.locked():
+            state = self.read()
+            if state.pop(key, None) is not None:
+                self.write(state)
@@ -0,0 +1,245 @@
+"""Classes for incremental sync
+
+Copy rows changed since the previous run from PostgreSQL into ReplacingMergeTree tables of Clickhouse.
+Changes are tracked per table by a watermark column - update timestamp, increasing id or xmin system column,
+max value of watermark is stored in a local JSON file after every inserted block. Watermarks are moved back
+by an overlap (timestamp, id) or capped by the oldest running transaction (xmin), so rows of transactions
+committed late are read on the next run
+
+Author: Anton Popkov
+
+"""
+
+import logging
+import pandas as pd
+from time import perf_counter
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from src.ErrorDecorator import ErrDecorator
+from src.Replication import Replicator
+from src.State import JSONStateStore
+
+XMIN_COLUMN = '_xmin'
+XMIN_EXPRESSION = 'xmin::text::bigint'
+XMIN_ORDER = 'age(xmin) desc'
+XID_RANGE = 2 ** 32
+
+
+def xid_after(xid, other):
+    """Function for comparing 32-bit transaction ids in circular order of PostgreSQL, so comparison
+    survives wraparound of transaction counter
+
+    Returns
+    -------
+    bool
+        True if xid is newer than other
+
+    """
+    return 0 < (xid - other) % XID_RANGE < XID_RANGE // 2
+
+
+class IncrementalSync(Replicator):
+    """Class for incremental sync of PostgreSQL tables into ReplacingMergeTree tables of Clickhouse.
+    Rows with watermark not less than the stored one are read again on the next run, duplicates
+    are collapsed by sorting key of ReplacingMergeTree. Deleted rows are not propagated
+
+    Parameters
+    ----------
+    mapper : TypesMapper class instance
+        provides catalog of source tables and mapping of types
+    creds : dict
+        parameters from config.yaml
+    from_db_params: dict
+        parameters for Connector to establish connection to source DB
+    to_db_params: dict
+        parameters for Connector to establish connection to target DB, func is clickhouse_driver.Client
+
+    """
+
+    def __init__(self, mapper, creds, from_db_params, to_db_params):
+        super().__init__(mapper, creds, from_db_params, to_db_params)
+        self.settings = creds.get('sync') or {}
+        self.state = JSONStateStore(self.settings['state_path'])
+
+    def table_settings(self, name):
+        """Method for getting sync settings of a table, defaults are taken from sync section
+
+        """
+        return {'watermark_type': 'timestamp', 'watermark_col': None, 'overlap_seconds': 0, 'overlap_ids': 0,
+                **super().table_settings(name)}
+
+    @staticmethod
+    def watermark_expression(settings):
+        return XMIN_EXPRESSION if settings['watermark_type'] == 'xmin' else settings['watermark_col']
+
+    @staticmethod
+    def parse_watermark(settings, value):
+        if value is None:
+            return None
+        return datetime.fromisoformat(value) if settings['watermark_type'] == 'timestamp' else int(value)
+
+    @staticmethod
+    def dump_watermark(value):
+        return value.isoformat() if isinstance(value, datetime) else int(value)
+
+    def where_clause(self, settings, watermark):
+        """Method for building where clause of rows past the watermark. Timestamp watermark is moved back
+        by overlap_seconds and id watermark by overlap_ids to catch rows of transactions committed late.
+        Xmin is compared by age, so the clause survives wraparound, it can not use an index and scans the table
+
+        """
+        if watermark is None:
+            return ''
+        if settings['watermark_type'] == 'timestamp':
+            value = watermark - timedelta(seconds=settings['overlap_seconds'])
+            return f"where {settings['watermark_col']} >= '{value.isoformat()}'"
+        if settings['watermark_type'] == 'xmin':
+            return f"where age(xmin) <= age('{watermark}'::xid)"
+        return f"where {settings['watermark_col']} >= {watermark - settings['overlap_ids']}"
+
+    def sync_columns(self, settings, columns_df):
+        """Method for adding xmin column to columns of a table synced by xmin. Nullable timestamp watermark
+        is the version column of ReplacingMergeTree and is selected with nulls replaced by the epoch
+
+        Returns
+        -------
+        tuple
+            pandas DataFrame of target columns, select list
+
+        """
+        columns = list(columns_df['column_name'])
+        if settings['watermark_type'] == 'timestamp':
+            column = settings['watermark_col']
+            nullable = columns_df.loc[columns_df['column_name'] == column, 'is_nullable']
+            if (nullable == 'YES').any():
+                logging.warning(f"{columns_df['table_name'].iat[0]}: watermark column {column} is nullable, "
+                                f"rows with null are synced only on the first run")
+                columns[columns.index(column)] = f"coalesce({column}, '1970-01-01') as {column}"
+        if settings['watermark_type'] != 'xmin':
+            return columns_df, columns
+        xmin_df = pd.DataFrame([{'table_name': columns_df['table_name'].iat[0], 'column_name': XMIN_COLUMN,
+                                 'data_type': 'xid', 'to_data_type': 'UInt64', 'is_nullable': 'NO'}])
+        return pd.concat([columns_df, xmin_df], ignore_index=True), columns + [f"{XMIN_EXPRESSION} as {XMIN_COLUMN}"]
+
+    @ErrDecorator.sys_error_decorator
+    def get_snapshot_xmin(self):
+        """Method for getting the oldest transaction still running in PostgreSQL, rows of older transactions
+        are committed and can not appear later
+
+        Returns
+        -------
+        int
+            32-bit transaction id
+
+        """
+        return int(self.fetch_one(self.creds['pg_queries']['snapshot_xmin_query'])[0])
+
+    @ErrDecorator.sys_error_decorator
+    def get_lag(self, name, settings, watermark, snapshot_xmin=None):
+        """Method for measuring distance between max watermark in source table and the stored one
+
+        Returns
+        -------
+        float
+            seconds for timestamp watermark, ids or transactions otherwise, None before the first sync
+
+        """
+        if settings['watermark_type'] == 'xmin':
+            return None if watermark is None else (snapshot_xmin - watermark) % XID_RANGE
+        column = self.watermark_expression(settings)
+        source_max = self.fetch_one(self.creds['pg_queries']['max_query'].format(name=name, column=column))[0]
+        if watermark is None or source_max is None:
+            return None
+        lag = source_max - watermark
+        return lag.total_seconds() if isinstance(lag, timedelta) else int(lag)
+
+    @ErrDecorator.sys_error_decorator
+    def sync_table(self, name, columns_df):
+        """Method for syncing rows changed since the previous run. Watermark is saved after every inserted block,
+        so an interrupted run continues from the last inserted block. Xmin watermark never passes the oldest
+        transaction running at the start of sync
+
+        Parameters
+        ----------
+        name : str
+            table name
+        columns_df : pandas DataFrame
+            mapped columns of source table
+
+        Returns
+        -------
+        dict
+            table name, synced rows, seconds, rows per second, lag before sync and watermark
+
+        """
+        settings = self.table_settings(name)
+        if not settings['order_by'] or not self.watermark_expression(settings):
+            logging.error(f"{name}: order_by and watermark_col are required for sync, skipped")
+            return None
+        columns_df, select_list = self.sync_columns(settings, columns_df)
+        version = {'timestamp': settings['watermark_col'], 'xmin': XMIN_COLUMN}.get(settings['watermark_type'], '')
+        with self.ch_client() as client:
+            engine = client.execute(self.creds['ch_queries']['engine_query'].format(name=name))
+            if engine and engine[0][0] != 'ReplacingMergeTree':
+                logging.error(f"{name}: Clickhouse table has {engine[0][0]} engine, skipped")
+                return None
+            client.execute(self.build_ddl(name, columns_df, query='create_replacing_query',
+                                          not_null=[version] if version else [], version=version))
+        watermark = self.parse_watermark(settings, self.state.get(name))
+        by_xmin = settings['watermark_type'] == 'xmin'
+        snapshot_xmin = self.get_snapshot_xmin() if by_xmin else None
+        lag = self.get_lag(name, settings, watermark, snapshot_xmin)
+        current = {'value': watermark}
+        index = len(select_list) - 1 if by_xmin else list(columns_df['column_name']).index(settings['watermark_col'])
+
+        def save_watermark(block):
+            values = [row[index] for row in block if row[index] is not None]
+            if not values:
+                return
+            if by_xmin:
+                value = snapshot_xmin if xid_after(values[-1], snapshot_xmin) else values[-1]
+                newer = current['value'] is None or xid_after(value, current['value'])
+            else:
+                value = max(values)
+                newer = current['value'] is None or value > current['value']
+            if newer:
+                current['value'] = value
+                self.state.set(name, self.dump_watermark(current['value']))
+
+        select = self.creds['pg_queries']['sync_query'].format(
+            name=name, columns=', '.join(select_list), where=self.where_clause(settings, watermark),
+            watermark=XMIN_ORDER if by_xmin else settings['watermark_col'])
+        start = perf_counter()
+        rows = self.insert_blocks(select, name, columns_df, settings['block_rows'], on_block=save_watermark)
+        seconds = perf_counter() - start
+        stats = {'table': name, 'rows': rows, 'seconds': round(seconds, 3), 'rows_sec': round(rows / seconds),
+                 'lag': lag, 'watermark': current['value']}
+        logging.info(f"{name}: {rows} rows synced in {seconds:.1f} s, {stats['rows_sec']} rows/sec, "
+                     f"lag before sync {lag}, watermark {current['value']}")
+        return stats
+
+    @ErrDecorator.sys_error_decorator
+    def execute_sync(self, tables=None):
+        """Method for syncing tables, sync.workers tables at a time
+
+        Parameters
+        ----------
+        tables : list
+            table names, tables of sync section if not specified
+
+        Returns
+        -------
+        list
+            statistics of synced tables
+
+        """
+        tables = tables or list(self.settings.get('tables') or {})
+        schemas = self.get_schemas(tables)
+        missing = set(tables) - set(schemas)
+        if missing:
+            logging.error(f"Tables {sorted(missing)} are not found or not mapped, skipped")
+        names = [name for name in tables if name in schemas]
+        workers = max(min(self.settings.get('workers', 1), len(names)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda name: self.sync_table(name, schemas[name]), names))
+        return [stats for stats in results if stats]
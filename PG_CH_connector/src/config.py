@@ -0,0 +1,74 @@
+"""Config
+
+Lazy loading of config.yaml. Path is taken from CLI, PG_CH_CONFIG environment variable or default location,
+parsed file is cached until its modification time changes
+
+Author: Anton Popkov
+
+"""
+
+import os
+import yaml
+import logging
+import threading
+
+CONFIG_ENV = 'PG_CH_CONFIG'
+DEFAULT_PATH = '/<path>/config.yaml'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def set_config_path(path):
+    """Function for setting config path of the process and its child processes
+
+    """
+    os.environ[CONFIG_ENV] = path
+
+
+def config_path():
+    return os.environ.get(CONFIG_ENV) or DEFAULT_PATH
+
+
+def setup(config):
+    """Function for configuring logging, metrics and connection pools from config, called on the first load
+
+    """
+    from src import Metrics, Pool
+    logging.basicConfig(
+        filename=config['logs_path'],
+        level=logging.INFO,
+        format='%(asctime)s :: %(name)s - %(levelname)s - %(message)s')
+    Metrics.configure(**(config.get('metrics') or {}))
+    Pool.configure(**(config.get('pool') or {}))
+
+
+def get_config(path=None):
+    """Function for getting parsed config. Parsed config is cached until modification time of the file changes
+
+    Parameters
+    ----------
+    path : str
+        config path, becomes config path of the process if specified
+
+    Returns
+    -------
+    dict
+        config
+
+    """
+    if path:
+        set_config_path(path)
+    path = config_path()
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r') as file:
+            config = yaml.safe_load(file)
+        first = not _cache
+        _cache[path] = (mtime, config)
+    if first:
+        setup(config)
+    return config